@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Final
+
+from ansible.plugins.action import ActionBase
+from ansible.utils.display import Display
+
+BUNDLE_TTL: Final[int] = 7 * 24 * 3600
+
+SHA_RE: Final[re.Pattern[str]] = re.compile(r"[0-9a-f]{40}|[0-9a-f]{64}")
+
+display: Final[Display] = Display()
+
+
+class ActionModule(ActionBase):
+    TRANSFERS_FILES = True
+
+    def run(self, tmp: str | None = None, task_vars: dict | None = None) -> dict:
+        result = super().run(tmp, task_vars)
+        del tmp
+
+        args = dict(self._task.args)
+        mirror_dir: str | None = args.pop("mirror_dir", None)
+        mirror_ttl = int(args.pop("mirror_ttl", 300))
+        git = shutil.which("git")
+        # TRANSFERS_FILES creates the remote tmpdir up front, so every path has to remove it again
+        try:
+            if not mirror_dir or not git:
+                if mirror_dir:
+                    display.warning("git is not available on the controller, syncing from upstream")
+                result.update(self._execute_module(module_args=args, task_vars=task_vars))
+                return result
+
+            query = self._execute_module(module_args={**args, "state": "query"}, task_vars=task_vars)
+            if query.get("failed"):
+                result.update(query)
+                return result
+
+            repos: list[dict] = [dict(entry) for entry in args.get("repos") or []]
+            mirrors = _Mirrors(git, Path(mirror_dir).expanduser(), mirror_ttl)
+            with ThreadPoolExecutor(int(args.get("jobs", 8))) as executor:
+                bundles = list(executor.map(mirrors.bundle, repos, (state["before"] for state in query["repos"])))
+
+            pending: list[dict] = []
+            current: dict[str, dict] = {}
+            for entry, state, (tip, bundle) in zip(repos, query["repos"], bundles):
+                if tip and tip == state["before"]:
+                    current[state["dest"]] = state
+                    continue
+                if bundle:
+                    remote = self._connection._shell.join_path(self._connection._shell.tmpdir, bundle.name)
+                    self._transfer_file(str(bundle), remote)
+                    self._fixup_perms2((self._connection._shell.tmpdir, remote))
+                    entry["bundle"] = remote
+                pending.append(entry)
+
+            synced: dict = {"changed": False, "repos": []}
+            if pending:
+                synced = self._execute_module(module_args={**args, "repos": pending}, task_vars=task_vars)
+            result.update(synced)
+            if "repos" in synced:
+                by_dest = {state["dest"]: state for state in synced["repos"]}
+                result["repos"] = [by_dest.get(state["dest"], current.get(state["dest"])) for state in query["repos"]]
+        finally:
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+
+        return result
+
+
+class _Mirrors:
+    __slots__ = ("_git", "_root", "_ttl")
+
+    def __init__(self, git: str, root: Path, ttl: int) -> None:
+        self._git = git
+        self._root = root
+        self._ttl = ttl
+
+    def bundle(self, entry: dict, base: str) -> tuple[str, Path | None]:
+        repo: str = entry["repo"]
+        version: str = entry.get("version", "HEAD")
+        mirror = self._root / f"{Path(repo).stem}-{hashlib.sha256(repo.encode()).hexdigest()[:12]}.git"
+        self._root.mkdir(parents=True, exist_ok=True)
+
+        # every fork serialises on the same lock, so a fleet run fetches each mirror once per ttl
+        with mirror.with_suffix(".lock").open("w", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._refresh(repo, mirror)
+                tip, ref = self._resolve(mirror, version)
+                if not tip or tip == base:
+                    return tip, None
+                return tip, self._create(mirror, ref, base, tip)
+            except subprocess.CalledProcessError as e:
+                display.warning(f"{repo}: controller mirror failed, syncing from upstream: {e.stderr.strip()}")
+                return "", None
+
+    def _create(self, mirror: Path, ref: str, base: str, tip: str) -> Path | None:
+        bundles = self._root / "bundles"
+        bundles.mkdir(exist_ok=True)
+
+        # bundles are shared by every host on the same base, so the name pins the ref as well as both ends
+        prefix = f"{mirror.stem}-{hashlib.sha256(ref.encode()).hexdigest()[:8]}"
+        candidates = [(bundles / f"{prefix}-{tip[:12]}.bundle", (ref,))]
+        if base and self._run_ok(mirror, "cat-file", "-e", f"{base}^{{commit}}"):
+            candidates.insert(0, (bundles / f"{prefix}-{base[:12]}-{tip[:12]}.bundle", (ref, f"^{base}")))
+        for dest, revs in candidates:
+            if dest.exists():
+                dest.touch()
+                return dest
+            if self._write(mirror, dest, *revs):
+                return dest
+        return None
+
+    def _refresh(self, repo: str, mirror: Path) -> None:
+        stamp = mirror / "FETCH_HEAD"
+        if not mirror.exists():
+            self._run(self._root, "clone", "--quiet", "--mirror", repo, str(mirror))
+        elif stamp.exists() and time.time() - stamp.stat().st_mtime < self._ttl:
+            return
+        else:
+            self._run(mirror, "remote", "set-url", "origin", repo)
+            self._run(mirror, "remote", "update", "--prune")
+            for bundle in (self._root / "bundles").glob(f"{mirror.stem}-*.bundle"):
+                if time.time() - bundle.stat().st_mtime > BUNDLE_TTL:
+                    bundle.unlink()
+        stamp.touch()
+
+    def _resolve(self, mirror: Path, version: str) -> tuple[str, str]:
+        if SHA_RE.fullmatch(version) and self._run_ok(mirror, "cat-file", "-e", f"{version}^{{commit}}"):
+            # bundles can only carry refs, so pinned commits get a private ref in the mirror
+            ref = f"refs/gitsync/{version}"
+            self._run(mirror, "update-ref", ref, version)
+            return version, ref
+
+        for ref in ("HEAD",) if version == "HEAD" else (f"refs/heads/{version}", f"refs/tags/{version}"):
+            if self._run_ok(mirror, "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"):
+                return self._run(mirror, "rev-parse", f"{ref}^{{commit}}").strip(), ref
+        return "", ""
+
+    def _run(self, mirror: Path, *args: str) -> str:
+        return subprocess.run(  # noqa: S603
+            [self._git, "-C", str(mirror), *args],
+            capture_output=True,
+            check=True,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+            text=True,
+        ).stdout
+
+    def _run_ok(self, mirror: Path, *args: str) -> bool:
+        try:
+            self._run(mirror, *args)
+        except subprocess.CalledProcessError:
+            return False
+        return True
+
+    def _write(self, mirror: Path, dest: Path, *revs: str) -> bool:
+        partial = dest.with_suffix(".partial")
+        if not self._run_ok(mirror, "bundle", "create", str(partial), *revs):
+            partial.unlink(missing_ok=True)
+            return False
+        partial.rename(dest)
+        return True
@@ -1,5 +1,9 @@
 import configparser
+import contextlib
 import fnmatch
+import hashlib
+import io
+import json
 import math
 import operator
 import os
@@ -7,14 +11,19 @@ import platform
 import shutil
 import subprocess
 import sys
+import tarfile
+import tempfile
+import time
 import urllib.request
 from abc import ABCMeta
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Iterable, Iterator, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
+import apt_pkg
 import lsb_release
 from apt import Cache, Package
+from apt.package import Version
 from aptsources.sourceslist import SourceEntry, SourcesList
 
 _APT_PREFERENCES_DIR = Path("/etc/apt/preferences.d")
@@ -22,6 +31,25 @@ _APT_SOURCES_LIST_DIR = Path("/etc/apt/sources.list.d")
 _APT_TRUSTED_GPG_DIR = Path("/etc/apt/trusted.gpg.d")
 
 
+@contextlib.contextmanager
+def _timed(phase: str) -> Iterator[None]:
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        print(f"[apt] {phase}: {time.monotonic() - start:.2f}s", file=sys.stderr)
+
+
+def _archive_name(version: Version) -> str:
+    # mirrors the file name apt gives downloaded archives (QuoteString in apt-pkg)
+    def quote(value: str, bad: str) -> str:
+        return "".join(f"%{ord(c):02x}" if c in bad or c == "%" or not " " < c < "\x7f" else c for c in value)
+
+    name = quote(version.package.shortname, "_:")
+    extension = version.filename.rpartition(".")[2]
+    return f"{name}_{quote(version.version, '_:')}_{quote(version.architecture, '_:.')}.{extension}"
+
+
 def _exponentials(space: int) -> Iterator[int]:
     start = 1
     while True:
@@ -29,6 +57,23 @@ def _exponentials(space: int) -> Iterator[int]:
         start *= space
 
 
+def _fetch(uri: str, timeout: float = 30, retries: int = 4) -> bytes:
+    for attempt, delay in zip(range(1, retries + 1), _exponentials(2)):
+        try:
+            with urllib.request.urlopen(uri, timeout=timeout) as f:
+                return f.read()
+        except OSError as e:
+            if attempt == retries:
+                raise RuntimeError(f"failed to fetch {uri} after {retries} attempts") from e
+            print(f"Retrying {uri} in {delay}s ({e})", file=sys.stderr)
+            time.sleep(delay)
+
+
+def _fetch_all(executor: ThreadPoolExecutor, uris: Iterable[str]) -> Dict[str, bytes]:
+    uris = list(dict.fromkeys(uris))
+    return dict(zip(uris, executor.map(_fetch, uris)))
+
+
 class _SimpleData(metaclass=ABCMeta):
     __slots__ = ()
 
@@ -48,9 +93,12 @@ class _SimpleData(metaclass=ABCMeta):
 class _APTKeyFile(_SimpleData):
     __slots__ = "_name", "_uri"
 
-    def save(self):
-        with urllib.request.urlopen(self._uri) as f:
-            p = subprocess.run(["gpg", "--dearmor"], input=f.read(), capture_output=True)
+    @property
+    def uri(self) -> str:
+        return self._uri
+
+    def save(self, downloads: Dict[str, bytes]):
+        p = subprocess.run(["gpg", "--dearmor"], input=downloads[self._uri], capture_output=True)
 
         if p.returncode:
             raise RuntimeError(f"failed to fetch key for {self._name}\n{p.stderr.decode('utf-8')}")
@@ -65,19 +113,19 @@ class _APTKeyFile(_SimpleData):
 class _APTRemoteRepoFile(_SimpleData):
     __slots__ = "_name", "_url"
 
-    def write_to(self, source_list: SourcesList):
+    @property
+    def uri(self) -> str:
+        return self._url
+
+    def write_to(self, source_list: SourcesList, downloads: Dict[str, bytes]):
         file = _APT_SOURCES_LIST_DIR / f"{self._name}.list"
-        with urllib.request.urlopen(self._url) as f:
-            source_list.list.extend(
-                SourceEntry(line, file)
-                for line in f.read().decode("utf-8").splitlines()
-            )
+        source_list.list.extend(SourceEntry(line, file) for line in downloads[self._url].decode("utf-8").splitlines())
 
 
 class _APTRepoFile(_SimpleData):
     __slots__ = "_architectures", "_components", "_dists", "_name", "_uri"
 
-    def write_to(self, sources_list: SourcesList):
+    def write_to(self, sources_list: SourcesList, _downloads: Dict[str, bytes]):
         file = _APT_SOURCES_LIST_DIR / f"{self._name}.list"
         for dist in self._dists:
             sources_list.add("deb", self._uri, dist, self._components, file=file, architectures=self._architectures)
@@ -133,11 +181,110 @@ class _WSLConfigFile(_SimpleData):
         os.chmod(wsl_conf_path, 0o644)
 
 
+# offline bootstrap bundle, an uncompressed tar archive (or a directory with the same layout):
+#   manifest.json         distribution, key/repo file URIs and the list/archive file names
+#   config.ubuntu.json    the configuration the bundle was built from
+#   downloads/<sha256>    raw key and remote repository files
+#   lists/                apt package lists, installed instead of running apt update
+#   archives/             .deb files, placed in the apt archive cache before committing
+class _Bundle:
+    __slots__ = "_manifest", "_root"
+
+    _FORMAT = 1
+
+    def __init__(self, root: Path) -> None:
+        self._root = root
+        with open(root / "manifest.json", "r", encoding="utf-8") as f:
+            self._manifest = json.load(f)
+
+        if self._manifest["format"] != self._FORMAT:
+            raise RuntimeError(f"Unsupported bundle format {self._manifest['format']}")
+        distinfo = lsb_release.get_distro_information()
+        if self._manifest["codename"] != distinfo["CODENAME"]:
+            raise RuntimeError(f"Bundle was built for {self._manifest['codename']}, not {distinfo['CODENAME']}")
+
+    @classmethod
+    @contextlib.contextmanager
+    def open(cls, path: Path) -> Iterator["_Bundle"]:
+        if path.is_dir():
+            yield cls(path)
+            return
+
+        with tempfile.TemporaryDirectory() as root, tarfile.open(path) as tar:
+            tar.extractall(root, filter="data")
+            yield cls(Path(root))
+
+    @staticmethod
+    def build(path: Path, config: str, downloads: Dict[str, bytes], archives: Iterable[str]) -> None:
+        lists_dir = Path(apt_pkg.config.find_dir("Dir::State::lists"))
+        archives_dir = Path(apt_pkg.config.find_dir("Dir::Cache::archives"))
+        distinfo = lsb_release.get_distro_information()
+        manifest = {
+            "format": _Bundle._FORMAT,
+            "codename": distinfo["CODENAME"],
+            "release": distinfo["RELEASE"],
+            "downloads": {},
+            "lists": [],
+            "archives": [],
+        }
+
+        def add(name: str, data: bytes) -> None:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+
+        with tarfile.open(path, "w") as tar:
+            for uri, data in downloads.items():
+                name = f"downloads/{hashlib.sha256(data).hexdigest()}"
+                manifest["downloads"][uri] = name
+                add(name, data)
+            for list_file in sorted(lists_dir.iterdir()):
+                if list_file.is_file() and list_file.name != "lock":
+                    tar.add(list_file, f"lists/{list_file.name}")
+                    manifest["lists"].append(list_file.name)
+            for name in archives:
+                archive = archives_dir / name
+                if archive.is_file():
+                    tar.add(archive, f"archives/{name}")
+                    manifest["archives"].append(name)
+                else:
+                    print(f"Archive {name} is not cached, leaving it out of the bundle", file=sys.stderr)
+            add("config.ubuntu.json", config.encode("utf-8"))
+            add("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        with open(self._root / "config.ubuntu.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @property
+    def downloads(self) -> Dict[str, bytes]:
+        return {uri: (self._root / name).read_bytes() for uri, name in self._manifest["downloads"].items()}
+
+    def install_archives(self) -> None:
+        self._install("archives", Path(apt_pkg.config.find_dir("Dir::Cache::archives")))
+
+    def install_lists(self) -> None:
+        self._install("lists", Path(apt_pkg.config.find_dir("Dir::State::lists")))
+
+    def _install(self, kind: str, target: Path) -> None:
+        for name in self._manifest[kind]:
+            dest = target / name
+            shutil.copyfile(self._root / kind / name, dest)
+            os.chown(dest, 0, 0)
+            os.chmod(dest, 0o644)
+
+
 class _Initialiser(_SimpleData):
     __slots__ = (
         "_apt_keys",
         "_apt_packages",
         "_apt_repos",
+        "_archives",
+        "_bundle",
+        "_downloads",
         "_var_autoremove",
         "_var_codename",
         "_var_desktop",
@@ -175,7 +322,10 @@ class _Initialiser(_SimpleData):
             folder.mkdir(0o755, False, False)
             os.chown(folder, 0, 0)
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], bundle: Optional[_Bundle] = None):
+        self._archives = []
+        self._bundle = bundle
+        self._downloads = {}
         self._var_codename = self._DIST_INFO["CODENAME"]
         self._var_release = self._DIST_INFO["RELEASE"]
         self._var_keep_old_config = False
@@ -242,50 +392,91 @@ class _Initialiser(_SimpleData):
             if attr.startswith("_var_"):
                 yield attr
 
+    @property
+    def archives(self) -> List[str]:
+        return self._archives
+
+    @property
+    def downloads(self) -> Dict[str, bytes]:
+        return self._downloads
+
     def _apt(self):
         if not self._var_keep_old_config:
-            self._reset_folders(_APT_SOURCES_LIST_DIR, _APT_PREFERENCES_DIR, _APT_TRUSTED_GPG_DIR)
-            self._reset_files(Path("/etc/apt/sources.list"), Path("/etc/apt/preferences"), Path("/etc/apt/trusted.gpg"))
-            Path("/etc/apt/trusted.gpg~").unlink(True)
-
-            sources_list = SourcesList()
-            for repo in self._apt_repos:
-                repo.write_to(sources_list)
-            sources_list.save()
-
-            with Pool() as pool:
-                pool.map(operator.methodcaller("save"), self._apt_keys)
-
-        with Cache() as cache:
-            cache.update()
-
-        # first mark all packages to be edited (install/upgrade)
-        packages = set(self._apt_packages)
-        with Cache() as cache, cache.actiongroup():
-            for package in cache:
-                package_name = package.name
-                if package_name in packages:
-                    package.mark_install(True, True, True)
-                    package.mark_auto(False)
-                    packages.remove(package_name)
+            # fetch everything up front so a network failure leaves the old configuration intact
+            with ThreadPoolExecutor() as executor:
+                with _timed("fetch"):
+                    if self._bundle:
+                        downloads = self._bundle.downloads
+                    else:
+                        downloads = _fetch_all(
+                            executor,
+                            (
+                                *(key.uri for key in self._apt_keys),
+                                *(repo.uri for repo in self._apt_repos if isinstance(repo, _APTRemoteRepoFile)),
+                            ),
+                        )
+                self._downloads = downloads
+
+                self._reset_folders(_APT_SOURCES_LIST_DIR, _APT_PREFERENCES_DIR, _APT_TRUSTED_GPG_DIR)
+                self._reset_files(
+                    Path("/etc/apt/sources.list"), Path("/etc/apt/preferences"), Path("/etc/apt/trusted.gpg")
+                )
+                Path("/etc/apt/trusted.gpg~").unlink(True)
+
+                sources_list = SourcesList()
+                for repo in self._apt_repos:
+                    repo.write_to(sources_list, downloads)
+                sources_list.save()
+
+                list(executor.map(operator.methodcaller("save", downloads), self._apt_keys))
+
+        with _timed("open"):
+            cache = Cache()
+
+        with cache:
+            with _timed("update"):
+                if self._bundle:
+                    self._bundle.install_lists()
                 else:
-                    package.mark_auto(True)
-            cache.commit()
-        if packages:
-            print("The following missing packages were ignored:", file=sys.stderr)
-            for package in packages:
-                print(f"  * {package}", file=sys.stderr)
-
-        # remove unused packages if requested
-        with Cache() as cache, cache.actiongroup():
-            for package in cache:
-                if package.is_auto_removable:
-                    if self._var_autoremove:
-                        package.mark_delete(True, True)
-                elif package.is_upgradable:
-                    if self._var_upgrade:
-                        package.mark_upgrade(not package.is_auto_installed)
-            cache.commit()
+                    cache.update()
+                cache.open()
+
+            # first mark all packages to be edited (install/upgrade)
+            packages = set(self._apt_packages)
+            with _timed("mark"):
+                with cache.actiongroup():
+                    for package in cache:
+                        package_name = package.name
+                        if package_name in packages:
+                            package.mark_install(True, True, True)
+                            package.mark_auto(False)
+                            packages.remove(package_name)
+                        else:
+                            package.mark_auto(True)
+
+                # the garbage state is only recomputed once the group above is released
+                with cache.actiongroup():
+                    for package in cache:
+                        if package.is_auto_removable:
+                            if self._var_autoremove:
+                                package.mark_delete(True, True)
+                        elif package.is_upgradable:
+                            if self._var_upgrade:
+                                package.mark_upgrade(not package.is_auto_installed)
+            if packages:
+                print("The following missing packages were ignored:", file=sys.stderr)
+                for package in packages:
+                    print(f"  * {package}", file=sys.stderr)
+
+            self._archives = [
+                _archive_name(package.candidate) for package in cache.get_changes() if not package.marked_delete
+            ]
+            if self._bundle:
+                with _timed("archives"):
+                    self._bundle.install_archives()
+
+            with _timed("commit"):
+                cache.commit()
 
     def _normalise_sizes(self, *args: List[str]):
         for size_key in args:
@@ -1,10 +1,36 @@
+import argparse
 import json
+from pathlib import Path
 
-from ._classes import _Initialiser
+from ._classes import _Bundle, _Initialiser
 
 
 def _main():
+    parser = argparse.ArgumentParser(prog="python -m init")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--bundle",
+        type=Path,
+        help="bootstrap from an offline bundle (archive or extracted directory) instead of the network",
+    )
+    source.add_argument(
+        "--build-bundle",
+        type=Path,
+        metavar="OUTPUT",
+        help="bootstrap this host, then pack everything it fetched into a bundle for identical hosts",
+    )
+    args = parser.parse_args()
+
+    if args.bundle:
+        with _Bundle.open(args.bundle) as bundle:
+            _Initialiser(bundle.config, bundle).run()
+        return
+
     with open("config.ubuntu.json", "r", encoding="utf-8") as f:
-        config = json.load(f)
+        config = f.read()
+
+    initialiser = _Initialiser(json.loads(config))
+    initialiser.run()
 
-    _Initialiser(config).run()
+    if args.build_bundle:
+        _Bundle.build(args.build_bundle, config, initialiser.downloads, initialiser.archives)
@@ -3,14 +3,130 @@
 
 from __future__ import annotations
 
+import contextlib
 import fnmatch
+import hashlib
+import json
 import re
-from typing import cast, final
+import shutil
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Final, cast, final
+from urllib.parse import urlsplit
 
 import apt
+import apt.progress.base
 import apt_pkg
 from ansible.module_utils.basic import AnsibleModule
 
+PLAN_INPUTS: Final[tuple[str, ...]] = (
+    "install",
+    "purge",
+    "purge_patterns",
+    "all_auto",
+    "install_recommends",
+    "install_suggests",
+)
+
+PATH_FILTERS: Final[dict[str, tuple[tuple[str, str], ...]]] = {
+    "docs": (
+        ("exclude", "/usr/share/doc/*"),
+        ("include", "/usr/share/doc/*/copyright"),
+        ("exclude", "/usr/share/info/*"),
+        ("exclude", "/usr/share/lintian/*"),
+    ),
+    "man": (
+        ("exclude", "/usr/share/man/*"),
+        ("exclude", "/usr/share/groff/*"),
+    ),
+    "locales": (
+        ("exclude", "/usr/share/locale/*"),
+        ("include", "/usr/share/locale/locale.alias"),
+    ),
+}
+
+
+@final
+class AcquireTimer(apt.progress.base.AcquireProgress):
+    __slots__ = ("_bytes", "_mirrors", "_seconds", "_since", "_started")
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._bytes = 0
+        self._mirrors: dict[str, list[float]] = {}
+        self._seconds = 0.0
+        self._since = 0.0
+        self._started: dict[str, float] = {}
+
+    def done(self, item: apt_pkg.AcquireItemDesc) -> None:
+        now = time.monotonic()
+        size: int = item.owner.filesize
+        self._bytes += size
+        mirror = self._mirrors.setdefault(urlsplit(item.uri).netloc, [0, now, now])
+        mirror[0] += size
+        mirror[1] = min(mirror[1], self._started.pop(item.uri, now))
+        mirror[2] = now
+
+    def fetch(self, item: apt_pkg.AcquireItemDesc) -> None:
+        self._started[item.uri] = time.monotonic()
+
+    def report(self) -> dict:
+        mirrors = {}
+        for netloc, (size, first, last) in sorted(self._mirrors.items()):
+            seconds = last - first
+            mirrors[netloc] = {
+                "bytes": int(size),
+                "seconds": round(seconds, 3),
+                "bytes_per_second": int(size / seconds) if seconds else None,
+            }
+        return {"bytes": self._bytes, "seconds": round(self._seconds, 3), "mirrors": mirrors}
+
+    def start(self) -> None:
+        super().start()
+        self._since = time.monotonic()
+
+    def stop(self) -> None:
+        super().stop()
+        self._seconds += time.monotonic() - self._since
+
+
+@final
+class InstallTimer(apt.progress.base.InstallProgress):
+    __slots__ = ("_configure", "_current", "_phases", "_since")
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._configure: dict[str, float] = {}
+        self._current: tuple[str, str] | None = None
+        self._phases: dict[str, float] = {}
+        self._since = 0.0
+
+    def finish_update(self) -> None:
+        self._switch(None)
+
+    def report(self, slowest: int) -> dict:
+        phases = {phase: round(seconds, 3) for phase, seconds in self._phases.items()}
+        ranked = sorted(self._configure.items(), key=lambda item: item[1], reverse=True)[:slowest]
+        phases["slowest_configure"] = [{"package": pkg, "seconds": round(seconds, 3)} for pkg, seconds in ranked]
+        return phases
+
+    def start_update(self) -> None:
+        self._since = time.monotonic()
+
+    def status_change(self, pkg: str, percent: float, status: str) -> None:  # noqa: ARG002
+        self._switch((pkg, _install_phase(status)))
+
+    def _switch(self, current: tuple[str, str] | None) -> None:
+        now = time.monotonic()
+        if self._current:
+            pkg, phase = self._current
+            self._phases[phase] = self._phases.get(phase, 0.0) + now - self._since
+            if phase == "configure":
+                self._configure[pkg] = self._configure.get(pkg, 0.0) + now - self._since
+        self._current = current
+        self._since = now
+
 
 @final
 class APTInstall:
@@ -20,7 +136,10 @@ class APTInstall:
         "_manual_after",
         "_manual_before",
         "_module",
+        "_plan",
         "_purge_regex",
+        "_replayed",
+        "_timings",
         "_version_after",
         "_version_before",
     )
@@ -30,7 +149,10 @@ class APTInstall:
     _manual_after: set[str]
     _manual_before: set[str]
     _module: AnsibleModule
+    _plan: dict
     _purge_regex: re.Pattern[str] | None
+    _replayed: bool
+    _timings: dict
     _version_after: dict[str, str]
     _version_before: dict[str, str]
 
@@ -40,20 +162,32 @@ class APTInstall:
         self._manual_after = set()
         self._manual_before = set()
         self._module = module
+        self._plan = {}
         patterns: list[str] = module.params["purge_patterns"]
         self._purge_regex = re.compile("|".join(f"({fnmatch.translate(p)})" for p in patterns)) if patterns else None
+        self._replayed = False
+        self._timings = {}
         self._version_after = {}
         self._version_before = {}
 
     def __enter__(self) -> APTInstall:
-        self._cache = apt.Cache().__enter__()
+        with self._timed("open"):
+            self._cache = apt.Cache().__enter__()
         return self
 
     def __exit__(self, *args: object, **kwargs: object) -> None:
         self._cache.__exit__(*args, **kwargs)
 
     def commit(self) -> None:
-        self._cache.commit()
+        acquire = AcquireTimer()
+        install = InstallTimer()
+        if self._module.params["segmented_download"]:
+            with self._timed("segmented_download"):
+                self._fetch_segmented()
+        with self._timed("commit"):
+            self._cache.commit(acquire, install)
+        self._timings["download"] = acquire.report()
+        self._timings.update(install.report(self._module.params["timing_slowest"]))
 
     def diff(self) -> tuple[bool, dict[str, str]]:
         return self._changed, {
@@ -64,40 +198,119 @@ class APTInstall:
         }
 
     def mark(self) -> None:
-        self._mark_purge()
-        self._mark_install()
+        with self._timed("mark"):
+            self._mark()
+
+    def plan(self) -> tuple[bool, dict]:
+        return self._replayed, self._plan
+
+    def prepare(self) -> None:
+        with self._timed("prepare"):
+            self._prepare()
+
+    def timings(self) -> dict:
+        return self._timings
+
+    def _digest(self) -> str:
+        digest = hashlib.sha256(usedforsecurity=False)
+        inputs = {name: self._module.params[name] for name in PLAN_INPUTS}
+        inputs["architectures"] = apt_pkg.get_architectures()
+        digest.update(json.dumps(inputs, sort_keys=True).encode("utf-8"))
+        digest.update(Path(apt_pkg.config.find_file("Dir::State::status")).read_bytes())
+        for path in sorted(Path(apt_pkg.config.find_dir("Dir::State::lists")).glob("*Release")):
+            digest.update(path.name.encode("utf-8"))
+            digest.update(path.read_bytes())
+        return digest.hexdigest()
+
+    def _fetch_segmented(self) -> None:
+        options: dict = self._module.params["segmented_download"]
+        archives = Path(apt_pkg.config.find_dir("Dir::Cache::archives"))
+        targets: list[tuple[apt.package.Version, Path]] = []
+        for pkg in self._cache.get_changes():
+            version = pkg.candidate
+            if pkg.marked_delete or not version or not version.sha256 or version.size < options["threshold"]:
+                continue
+            dest = archives / _archive_name(version)
+            if not dest.exists():
+                targets.append((version, dest))
+        if not targets:
+            return
+
+        aria2c = self._module.get_bin_path("aria2c")
+        if not aria2c:
+            self._module.warn("aria2c not found, leaving large archives to apt")
+            return
+
+        partial = archives / "partial"
+        connections: int = options["connections"]
+        rc, _, err = self._module.run_command(
+            [
+                aria2c,
+                "--input-file=-",
+                f"--dir={partial}",
+                f"--max-connection-per-server={connections}",
+                f"--split={connections}",
+                f"--min-split-size={options['min_split_size']}",
+                "--allow-overwrite=true",
+                "--auto-file-renaming=false",
+                "--console-log-level=warn",
+                "--file-allocation=none",
+                "--summary-interval=0",
+            ],
+            data="".join(
+                "{}\n  out={}\n  checksum=sha-256={}\n".format("\t".join(version.uris), dest.name, version.sha256)
+                for version, dest in targets
+            ),
+        )
+        if rc:
+            self._module.warn(f"aria2c failed, apt will fetch the remaining archives\n{err}")
+
+        for version, dest in targets:
+            part = partial / dest.name
+            if not part.is_file():
+                continue
+            with part.open("rb") as f:
+                digest = hashlib.file_digest(f, "sha256").hexdigest()
+            if digest == version.sha256:
+                part.rename(dest)
+            else:
+                self._module.warn(f"Discarding {part}: sha256 mismatch")
+                part.unlink()
+
+    def _format(self, versions: dict[str, str], manual: set[str]) -> str:
+        return "".join("{}: {} <{}>\n".format(n, v, "manual" if n in manual else "auto") for n, v in versions.items())
+
+    def _mark(self) -> None:
+        digest = self._digest()
+        plan: dict | None = self._module.params["plan"]
+        if plan and plan.get("digest") == digest:
+            self._replayed = self._replay(plan)
+            if not self._replayed:
+                self._module.warn("Plan replay left broken packages, resolving instead")
+                self._reset()
+        if not self._replayed:
+            self._mark_purge()
+            self._mark_install()
+
+        install: dict[str, str] = {}
+        purge: list[str] = []
         for pkg in self._cache.get_changes():
             self._changed = True
             if pkg.marked_delete:
                 self._version_after.pop(pkg.name, None)
+                purge.append(pkg.name)
             elif pkg.marked_upgrade:
                 self._version_after[pkg.name] = pkg.candidate.version
+                install[pkg.name] = pkg.candidate.version
             elif pkg.marked_install:
                 self._version_after[pkg.name] = pkg.candidate.version
-
-    def prepare(self) -> None:
-        apt_pkg.config.set("APT::Install-Recommends", str(self._module.params["install_recommends"]))
-        apt_pkg.config.set("APT::Install-Suggests", str(self._module.params["install_suggests"]))
-        apt_pkg.config.set("Dpkg::Options::", "--force-confdef")
-        apt_pkg.config.set("Dpkg::Options::", "--force-confold")
-        if self._module.params["update_cache"]:
-            self._cache.update()
-            self._cache.open()
-        all_auto = self._module.params["all_auto"]
-        with self._cache.actiongroup():
-            for pkg in self._cache:
-                if pkg.is_installed:
-                    self._version_before[pkg.name] = pkg.installed.version
-                    self._version_after[pkg.name] = pkg.installed.version
-                    if not pkg.is_auto_installed:
-                        self._manual_before.add(pkg.name)
-                        if all_auto:
-                            pkg.mark_auto(True)
-                        else:
-                            self._manual_after.add(pkg.name)
-
-    def _format(self, versions: dict[str, str], manual: set[str]) -> str:
-        return "".join("{}: {} <{}>\n".format(n, v, "manual" if n in manual else "auto") for n, v in versions.items())
+                install[pkg.name] = pkg.candidate.version
+        self._plan = {
+            "digest": digest,
+            "install": install,
+            "purge": purge,
+            "manual": sorted(self._manual_after),
+        }
 
     def _mark_install(self) -> None:
         unknown: list[str] = []
@@ -131,6 +344,196 @@ class APTInstall:
         if unknown:
             self._module.warn("Unknown packages in purge: " + ", ".join(unknown))
 
+    def _prepare(self) -> None:
+        apt_pkg.config.set("APT::Install-Recommends", str(self._module.params["install_recommends"]))
+        apt_pkg.config.set("APT::Install-Suggests", str(self._module.params["install_suggests"]))
+        apt_pkg.config.set("Dpkg::Options::", "--force-confdef")
+        apt_pkg.config.set("Dpkg::Options::", "--force-confold")
+        if self._module.params["update_cache"]:
+            with self._timed("update"):
+                self._cache.update()
+                self._cache.open()
+        all_auto = self._module.params["all_auto"]
+        with self._cache.actiongroup():
+            for pkg in self._cache:
+                if pkg.is_installed:
+                    self._version_before[pkg.name] = pkg.installed.version
+                    self._version_after[pkg.name] = pkg.installed.version
+                    if not pkg.is_auto_installed:
+                        self._manual_before.add(pkg.name)
+                        if all_auto:
+                            pkg.mark_auto(True)
+                        else:
+                            self._manual_after.add(pkg.name)
+
+    def _replay(self, plan: dict) -> bool:
+        manual: list[str] = plan["manual"]
+        with self._cache.actiongroup():
+            for name in plan["purge"]:
+                pkg = self._cache.get(name)
+                if not pkg:
+                    return False
+                pkg.mark_delete(auto_fix=False, purge=True)
+            for name, version in plan["install"].items():
+                pkg = self._cache.get(name)
+                candidate = pkg.versions.get(version) if pkg else None
+                if not candidate:
+                    return False
+                pkg.candidate = candidate
+                pkg.mark_install(auto_fix=False, auto_inst=False, from_user=name in manual)
+            for name in manual:
+                pkg = self._cache.get(name)
+                if pkg:
+                    pkg.mark_auto(False)
+        self._manual_after = set(manual)
+        return self._cache.broken_count == 0
+
+    def _reset(self) -> None:
+        self._cache.clear()
+        if self._module.params["all_auto"]:
+            self._manual_after = set()
+            with self._cache.actiongroup():
+                for name in self._manual_before:
+                    self._cache[name].mark_auto(True)
+        else:
+            self._manual_after = set(self._manual_before)
+
+    @contextlib.contextmanager
+    def _timed(self, phase: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._timings[phase] = round(time.monotonic() - start, 3)
+
+
+@final
+class DpkgPathFilter:
+    __slots__ = (
+        "_after",
+        "_before",
+        "_bytes_saved",
+        "_cfgfile",
+        "_fsgroup",
+        "_fsowner",
+        "_infodir",
+        "_module",
+        "_rules",
+    )
+
+    def __init__(self, module: AnsibleModule, cfgfile: Path, infodir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._cfgfile = cfgfile
+        self._infodir = infodir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._before: list[str] = []
+        self._after: list[str] = []
+        self._bytes_saved = 0
+        self._rules: list[tuple[str, str]] = []
+
+    def bytes_saved(self) -> int:
+        return self._bytes_saved
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after or self._bytes_saved > 0, {
+            "before": "".join(self._before),
+            "before_header": str(self._cfgfile),
+            "after": "".join(self._after),
+            "after_header": str(self._cfgfile),
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode or self._before == self._after:
+            return
+
+        if self._after:
+            self._cfgfile.write_text("".join(self._after), encoding="utf-8")
+            self._cfgfile.chmod(0o644)
+            shutil.chown(self._cfgfile, self._fsowner, self._fsgroup)
+        else:
+            self._cfgfile.unlink(missing_ok=True)
+
+    def populate(self) -> None:
+        filters: dict | None = self._module.params["path_filters"]
+        if filters is None:
+            self._after = list(self._before)
+            return
+
+        for name, rules in PATH_FILTERS.items():
+            if filters[name]:
+                self._rules.extend(rules)
+        if filters["locales"]:
+            self._rules.extend(("include", f"/usr/share/locale/{locale}/*") for locale in filters["keep_locales"])
+        self._after = [f"path-{kind}={pattern}\n" for kind, pattern in self._rules]
+
+    def prepare(self) -> None:
+        if self._cfgfile.exists():
+            self._before = self._cfgfile.read_text(encoding="utf-8").splitlines(keepends=True)
+
+    def prune(self) -> None:
+        filters: dict | None = self._module.params["path_filters"]
+        if not filters or not filters["prune"] or not self._rules:
+            return
+
+        seen: set[str] = set()
+        for listfile in sorted(self._infodir.glob("*.list")):
+            for line in listfile.read_text(encoding="utf-8", errors="surrogateescape").splitlines():
+                if line in seen or not _path_excluded(line, self._rules):
+                    continue
+                seen.add(line)
+                path = Path(line)
+                if path.is_symlink() or path.is_file():
+                    self._bytes_saved += path.lstat().st_size
+                    if not self._module.check_mode:
+                        path.unlink()
+
+
+def _archive_name(version: apt.package.Version) -> str:
+    return "{}_{}_{}.{}".format(
+        _quote(version.package.shortname, "_:"),
+        _quote(version.version, "_:"),
+        _quote(version.architecture, "_:."),
+        version.filename.rpartition(".")[2],
+    )
+
+
+def _fingerprint(params: dict) -> str:
+    digest = hashlib.sha256(usedforsecurity=False)
+    inputs = {name: params[name] for name in PLAN_INPUTS}
+    inputs["path_filters"] = params["path_filters"]
+    digest.update(json.dumps(inputs, sort_keys=True).encode("utf-8"))
+    digest.update(Path(apt_pkg.config.find_file("Dir::State::status")).read_bytes())
+    for path in sorted(Path(apt_pkg.config.find_dir("Dir::State::lists")).iterdir()):
+        if path.is_file() and path.name != "lock":
+            stat = path.stat()
+            digest.update(f"{path.name} {stat.st_mtime_ns} {stat.st_size}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _install_phase(status: str) -> str:
+    if status.startswith(("Configuring", "Preparing to configure")):
+        return "configure"
+    if status.startswith(
+        ("Removing", "Removed", "Completely removed", "Preparing for removal", "Preparing to completely")
+    ):
+        return "remove"
+    if status.startswith(("Unpacking", "Preparing")):
+        return "unpack"
+    return "other"
+
+
+def _path_excluded(path: str, rules: list[tuple[str, str]]) -> bool:
+    excluded = False
+    for kind, pattern in rules:
+        if fnmatch.fnmatchcase(path, pattern):
+            excluded = kind == "exclude"
+    return excluded
+
+
+def _quote(value: str, bad: str) -> str:
+    return "".join(f"%{ord(c):02x}" if c in bad or c == "%" or not " " < c < "\x7f" else c for c in value)
+
 
 def _run_module() -> None:
     module = AnsibleModule(
@@ -166,22 +569,110 @@ def _run_module() -> None:
                 "type": "bool",
                 "default": False,
             },
+            "plan": {
+                "type": "dict",
+            },
+            "timing_slowest": {
+                "type": "int",
+                "default": 10,
+            },
+            "fingerprint_path": {
+                "type": "path",
+                "default": "/var/lib/aptinstall/fingerprint",
+            },
+            "segmented_download": {
+                "type": "dict",
+                "options": {
+                    "threshold": {
+                        "type": "int",
+                        "default": 104857600,
+                    },
+                    "connections": {
+                        "type": "int",
+                        "default": 8,
+                    },
+                    "min_split_size": {
+                        "type": "str",
+                        "default": "8M",
+                    },
+                },
+            },
+            "path_filters": {
+                "type": "dict",
+                "options": {
+                    "docs": {
+                        "type": "bool",
+                        "default": False,
+                    },
+                    "man": {
+                        "type": "bool",
+                        "default": False,
+                    },
+                    "locales": {
+                        "type": "bool",
+                        "default": False,
+                    },
+                    "keep_locales": {
+                        "type": "list",
+                        "elements": "str",
+                        "default": ["en", "en_*"],
+                    },
+                    "prune": {
+                        "type": "bool",
+                        "default": False,
+                    },
+                },
+            },
         },
         supports_check_mode=True,
     )
 
+    fingerprint_path = Path(module.params["fingerprint_path"]) if module.params["fingerprint_path"] else None
+    if (
+        fingerprint_path
+        and not module.params["update_cache"]
+        and fingerprint_path.is_file()
+        and fingerprint_path.read_text(encoding="utf-8") == _fingerprint(module.params)
+    ):
+        module.exit_json(
+            changed=False, msg="fingerprint unchanged", bytes_saved=0, plan={}, plan_replayed=False, timings={}
+        )
+
+    path_filter = DpkgPathFilter(
+        module, Path("/etc/dpkg/dpkg.cfg.d/aptinstall"), Path("/var/lib/dpkg/info"), "root", "root"
+    )
+    path_filter.prepare()
+    path_filter.populate()
+    path_filter.flush()
+
     with APTInstall(module) as installer:
         installer.prepare()
         installer.mark()
 
         changed, diff = installer.diff()
+        replayed, plan = installer.plan()
 
-        if module.check_mode:
-            module.exit_json(changed=changed, diff=diff)
+        if not module.check_mode:
+            installer.commit()
 
-        installer.commit()
+    path_filter.prune()
 
-    module.exit_json(changed=changed, diff=diff)
+    filter_changed, filter_diff = path_filter.diff()
+    diffs = [diff, filter_diff] if filter_changed else [diff]
+
+    if fingerprint_path and not module.check_mode:
+        fingerprint_path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+        fingerprint_path.write_text(_fingerprint(module.params), encoding="utf-8")
+        fingerprint_path.chmod(0o644)
+
+    module.exit_json(
+        changed=changed or filter_changed,
+        diff=diffs,
+        bytes_saved=path_filter.bytes_saved(),
+        plan=plan,
+        plan_replayed=replayed,
+        timings=installer.timings(),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import re
+import shutil
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+# applied in this order, nr_requests is bounded by the scheduler that is active when it is written
+ATTRIBUTES: Final[tuple[str, ...]] = ("scheduler", "nr_requests", "read_ahead_kb", "rq_affinity")
+
+# NVMe keeps the hardware queue depth for nr_requests, which is what "none" schedules against
+CLASS_SETTINGS: Final[dict[str, dict[str, str]]] = {
+    "nvme": {
+        "scheduler": "none",
+        "read_ahead_kb": "128",
+        "rq_affinity": "2",
+    },
+    "ssd": {
+        "scheduler": "mq-deadline",
+        "nr_requests": "256",
+        "read_ahead_kb": "128",
+        "rq_affinity": "2",
+    },
+    "hdd": {
+        "scheduler": "mq-deadline",
+        "nr_requests": "256",
+        "read_ahead_kb": "4096",
+        "rq_affinity": "1",
+    },
+}
+
+MATCHES: Final[dict[str, str]] = {
+    "nvme": 'KERNEL=="nvme[0-9]*n[0-9]*"',
+    "ssd": 'KERNEL=="sd[a-z]*|vd[a-z]*", ATTR{queue/rotational}=="0"',
+    "hdd": 'KERNEL=="sd[a-z]*|vd[a-z]*", ATTR{queue/rotational}=="1"',
+}
+
+
+@final
+class BlockQueue:
+    __slots__ = ("_after", "_before", "_devices", "_fsgroup", "_fsowner", "_module", "_rules", "_sysfs")
+
+    def __init__(self, module: AnsibleModule, rules: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._rules = rules
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._sysfs = Path("/sys/block")
+        self._before: dict[str, str] = {}
+        self._after: dict[str, str] = {}
+        self._devices: dict[str, str] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "block queues",
+            "after": self._format(self._after),
+            "after_header": "block queues",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode or self._before == self._after:
+            return
+
+        key = str(self._rules)
+        if self._before[key] != self._after[key]:
+            self._rules.write_text(self._after[key], encoding="utf-8")
+            self._rules.chmod(0o644)
+            shutil.chown(self._rules, self._fsowner, self._fsgroup)
+            udevadm = self._module.get_bin_path("udevadm", required=True)
+            self._module.run_command([udevadm, "control", "--reload"], check_rc=True)
+
+        for device in self._devices:
+            for attribute in ATTRIBUTES:
+                key = f"{device} {attribute}"
+                if self._before[key] == self._after[key]:
+                    continue
+                try:
+                    (self._sysfs / device / "queue" / attribute).write_text(self._after[key], encoding="ascii")
+                except OSError as e:
+                    self._module.warn(f"{device} rejected {attribute}={self._after[key]}: {e}")
+
+    def populate(self) -> None:
+        settings = self._settings()
+        self._after[str(self._rules)] = "".join(
+            f'ACTION=="add|change", {MATCHES[cls]}, ENV{{DEVTYPE}}=="disk", '
+            + ", ".join(f'ATTR{{queue/{attribute}}}="{value}"' for attribute, value in values.items())
+            + "\n"
+            for cls, values in settings.items()
+        )
+
+        for device, cls in self._devices.items():
+            for attribute, value in settings[cls].items():
+                key = f"{device} {attribute}"
+                if attribute == "scheduler" and value not in self._schedulers(device):
+                    self._module.warn(f"{device} does not offer the {value} scheduler")
+                    continue
+                self._after[key] = value
+
+    def prepare(self) -> None:
+        self._before[str(self._rules)] = self._rules.read_text(encoding="utf-8") if self._rules.exists() else ""
+        for path in sorted(self._sysfs.iterdir()):
+            cls = _class(path)
+            if cls is None:
+                continue
+            self._devices[path.name] = cls
+            for attribute in ATTRIBUTES:
+                key = f"{path.name} {attribute}"
+                self._before[key] = self._after[key] = self._read(path.name, attribute)
+
+    def _format(self, state: dict[str, str]) -> str:
+        files = "".join(f"[{key}]\n{value}" for key, value in state.items() if key.startswith("/") and value)
+        return files + "".join(f"[{key.replace(' ', '] ')}: {value}\n" for key, value in state.items() if key[0] != "/")
+
+    def _read(self, device: str, attribute: str) -> str:
+        path = self._sysfs / device / "queue" / attribute
+        if not path.exists():
+            return ""
+        value = path.read_text(encoding="ascii").strip()
+        if attribute == "scheduler":
+            match = re.search(r"\[(\S+)\]", value)
+            return match.group(1) if match else value
+        return value
+
+    def _schedulers(self, device: str) -> list[str]:
+        path = self._sysfs / device / "queue" / "scheduler"
+        return path.read_text(encoding="ascii").replace("[", "").replace("]", "").split() if path.exists() else []
+
+    def _settings(self) -> dict[str, dict[str, str]]:
+        settings: dict[str, dict[str, str]] = {}
+        for cls, defaults in CLASS_SETTINGS.items():
+            overrides = self._module.params[cls] or {}
+            settings[cls] = {
+                attribute: str(overrides[attribute]) if overrides.get(attribute) is not None else defaults[attribute]
+                for attribute in ATTRIBUTES
+                if overrides.get(attribute) is not None or attribute in defaults
+            }
+        return settings
+
+
+def _class(path: Path) -> str | None:
+    if re.fullmatch(r"nvme\d+n\d+", path.name):
+        return "nvme"
+    if re.fullmatch(r"(?:sd|vd)[a-z]+", path.name):
+        rotational = path / "queue" / "rotational"
+        return "hdd" if rotational.read_text(encoding="ascii").strip() == "1" else "ssd"
+    return None
+
+
+def _run_module() -> None:
+    queue = {
+        "type": "dict",
+        "default": {},
+        "options": {
+            "scheduler": {
+                "type": "str",
+            },
+            "read_ahead_kb": {
+                "type": "int",
+            },
+            "nr_requests": {
+                "type": "int",
+            },
+            "rq_affinity": {
+                "type": "int",
+                "choices": [0, 1, 2],
+            },
+        },
+    }
+    module = AnsibleModule(
+        argument_spec={
+            "nvme": queue,
+            "ssd": queue,
+            "hdd": queue,
+        },
+        supports_check_mode=True,
+    )
+
+    blockqueue = BlockQueue(module, Path("/etc/udev/rules.d/60-blockqueue.rules"), "root", "root")
+    blockqueue.prepare()
+    blockqueue.populate()
+    blockqueue.flush()
+
+    changed, diff = blockqueue.diff()
+    module.exit_json(changed=changed, diff=diff)
+
+
+if __name__ == "__main__":
+    _run_module()
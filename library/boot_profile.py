@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+BOOT_ID: Final[Path] = Path("/proc/sys/kernel/random/boot_id")
+
+DROPIN: Final[str] = "50-boot-profile.conf"
+
+UNITS: Final[dict[str, float]] = {
+    "h": 3600.0,
+    "min": 60.0,
+    "s": 1.0,
+    "ms": 0.001,
+    "us": 0.000001,
+}
+
+
+@final
+class BootProfile:
+    __slots__ = (
+        "_after",
+        "_analyze",
+        "_before",
+        "_fsgroup",
+        "_fsowner",
+        "_module",
+        "_records",
+        "_statedir",
+        "_unitdir",
+    )
+
+    def __init__(self, module: AnsibleModule, statedir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._statedir = statedir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._unitdir = Path("/etc/systemd/system")
+        self._analyze = module.get_bin_path("systemd-analyze", required=True)
+        self._before: dict[str, str] = {}
+        self._after: dict[str, str] = {}
+        self._records: dict[str, dict] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "boot profile",
+            "after": self._format(self._after),
+            "after_header": "boot profile",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode:
+            return
+
+        # the history is bookkeeping rather than host configuration, so it is kept up to date silently
+        if self._records.get("current"):
+            if not self._statedir.exists():
+                self._statedir.mkdir(mode=0o755, parents=True)
+                shutil.chown(self._statedir, self._fsowner, self._fsgroup)
+            path = self._statedir / "boots.json"
+            path.write_text(json.dumps(self._records, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+            path.chmod(0o644)
+            shutil.chown(path, self._fsowner, self._fsgroup)
+
+        if self._before == self._after:
+            return
+
+        systemctl = self._module.get_bin_path("systemctl", required=True)
+        for key, value in self._after.items():
+            if value == self._before[key]:
+                continue
+            if key.startswith("unit "):
+                self._module.run_command([systemctl, "mask", key.removeprefix("unit ")], check_rc=True)
+                continue
+            path = Path(key)
+            if not path.parent.exists():
+                path.parent.mkdir(mode=0o755)
+                shutil.chown(path.parent, "root", "root")
+            path.write_text(value, encoding="utf-8")
+            path.chmod(0o644)
+            shutil.chown(path, "root", "root")
+        self._module.run_command([systemctl, "daemon-reload"], check_rc=True)
+
+    def populate(self) -> None:
+        current = self._records.get("current")
+        if not current:
+            return
+
+        allowlist = {entry["unit"]: entry for entry in self._module.params["allowlist"]}
+        userspace = current["time"].get("userspace") or current["time"].get("total") or 0.0
+        for link in current["critical_chain"]:
+            entry = allowlist.get(link["unit"])
+            if entry is None or not link["duration"] or link["duration"] < self._module.params["share"] * userspace:
+                continue
+            if entry["action"] == "mask":
+                self._after[f"unit {link['unit']}"] = "masked"
+            elif not link["unit"].endswith(".service"):
+                self._module.warn(f"{link['unit']} is not a service and can only be masked")
+            else:
+                self._after[str(self._dropin(link["unit"]))] = f"[Service]\nTimeoutStartSec={entry['timeout']}\n"
+
+    def prepare(self) -> None:
+        path = self._statedir / "boots.json"
+        self._records = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+
+        systemctl = self._module.get_bin_path("systemctl", required=True)
+        for entry in self._module.params["allowlist"]:
+            unit: str = entry["unit"]
+            if entry["action"] == "mask":
+                _, out, _ = self._module.run_command([systemctl, "is-enabled", unit])
+                self._before[f"unit {unit}"] = self._after[f"unit {unit}"] = out.strip() or "not-found"
+            else:
+                # applied actions are kept, they are the reason the unit no longer dominates the boot
+                dropin = self._dropin(unit)
+                self._before[str(dropin)] = self._after[str(dropin)] = (
+                    dropin.read_text(encoding="utf-8") if dropin.exists() else ""
+                )
+
+        boot_id = BOOT_ID.read_text(encoding="ascii").strip()
+        current = self._records.get("current")
+        if current and current["boot_id"] == boot_id:
+            return
+
+        rc, out, err = self._module.run_command([self._analyze, "time"])
+        if rc != 0:
+            self._module.warn(f"boot has not finished yet and was not profiled: {err.strip() or out.strip()}")
+            return
+        record = {
+            "boot_id": boot_id,
+            "recorded": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "time": _times(out),
+            "blame": self._blame(),
+            "critical_chain": self._critical_chain(),
+        }
+        if current:
+            self._records["previous"] = current
+        self._records["current"] = record
+
+    def results(self) -> dict:
+        current: dict = self._records.get("current") or {}
+        previous: dict = self._records.get("previous") or {}
+        delta: dict[str, dict[str, float]] = {}
+        if current and previous:
+            delta["time"] = {
+                stage: round(seconds - previous["time"][stage], 3)
+                for stage, seconds in current["time"].items()
+                if stage in previous["time"]
+            }
+            delta["blame"] = {
+                unit: round(seconds - previous["blame"][unit], 3)
+                for unit, seconds in current["blame"].items()
+                if unit in previous["blame"]
+            }
+        return {"current": current, "previous": previous, "delta": delta}
+
+    def _blame(self) -> dict[str, float]:
+        _, out, _ = self._module.run_command([self._analyze, "blame", "--no-pager"], check_rc=True)
+        blame: dict[str, float] = {}
+        for line in out.splitlines()[: self._module.params["top"]]:
+            match = re.fullmatch(r"\s*(.+?)\s+(\S+)\s*", line)
+            if match:
+                blame[match.group(2)] = _seconds(match.group(1))
+        return blame
+
+    def _critical_chain(self) -> list[dict]:
+        _, out, _ = self._module.run_command([self._analyze, "critical-chain", "--no-pager"], check_rc=True)
+        chain: list[dict] = []
+        for line in out.splitlines():
+            match = re.fullmatch(r"[\s│├└─]*(\S+\.\w+) @(.+?)(?: \+(.+?))?\s*", line)
+            if match:
+                chain.append(
+                    {
+                        "unit": match.group(1),
+                        "at": _seconds(match.group(2)),
+                        "duration": _seconds(match.group(3)) if match.group(3) else 0.0,
+                    }
+                )
+        return chain
+
+    def _dropin(self, unit: str) -> Path:
+        return self._unitdir / f"{unit}.d" / DROPIN
+
+    def _format(self, state: dict[str, str]) -> str:
+        files = "".join(f"[{key}]\n{value}" for key, value in sorted(state.items()) if key.startswith("/") and value)
+        return files + "".join(f"{key}: {value}\n" for key, value in sorted(state.items()) if key.startswith("unit "))
+
+
+def _seconds(value: str) -> float:
+    return round(sum(float(number) * UNITS[unit] for number, unit in re.findall(r"([\d.]+)(h|min|ms|us|s)", value)), 3)
+
+
+def _times(out: str) -> dict[str, float]:
+    times = {stage: _seconds(value) for value, stage in re.findall(r"((?:[\d.]+(?:h|min|ms|us|s)\s?)+) \((\w+)\)", out)}
+    total = re.search(r"= ((?:[\d.]+(?:h|min|ms|us|s)\s?)+)", out)
+    if total:
+        times["total"] = _seconds(total.group(1))
+    return times
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "allowlist": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "unit": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "action": {
+                        "type": "str",
+                        "choices": ["mask", "timeout"],
+                        "default": "timeout",
+                    },
+                    "timeout": {
+                        "type": "str",
+                        "default": "10s",
+                    },
+                },
+            },
+            "share": {
+                "type": "float",
+                "default": 0.2,
+            },
+            "top": {
+                "type": "int",
+                "default": 20,
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    profile = BootProfile(module, Path("/var/lib/boot_profile"), "root", "root")
+    profile.prepare()
+    profile.populate()
+    profile.flush()
+
+    changed, diff = profile.diff()
+    module.exit_json(changed=changed, diff=diff, **profile.results())
+
+
+if __name__ == "__main__":
+    _run_module()
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+BLOCK_SIZE: Final[int] = 4096
+
+# journal size in MB for non-rotational devices above JOURNAL_THRESHOLD, the default scales down to 128MB
+JOURNAL_SIZE: Final[int] = 1024
+
+JOURNAL_THRESHOLD: Final[int] = 32 * 1024 * 1024 * 1024
+
+# data disks per md level, given the number of member disks
+RAID_DATA_DISKS: Final[dict[str, int]] = {
+    "raid0": 0,
+    "raid4": 1,
+    "raid5": 1,
+    "raid6": 2,
+}
+
+
+@final
+class FilesystemGeometry:
+    __slots__ = ("_blkid", "_module", "_partitions", "_sysfs")
+
+    def __init__(self, module: AnsibleModule, sysfs: Path) -> None:
+        self._module = module
+        self._sysfs = sysfs
+        self._blkid = module.get_bin_path("blkid", required=True)
+        self._partitions: list[dict] = []
+
+    def populate(self) -> None:
+        disks: dict[str, str] = self._module.params["disks"]
+        for item in self._module.params["partitions"]:
+            dev = f"{self._module.params['prefix']}{disks[item['disk']]}-part{item['partition']}"
+            fstype: str = item.get("filesystem") or "ext4"
+            geometry = self._geometry(Path(dev))
+            self._partitions.append(
+                {
+                    **item,
+                    "dev": dev,
+                    "fstype": fstype,
+                    "geometry": geometry,
+                    "opts": " ".join(_options(fstype, item.get("uuid"), geometry)),
+                    "populated": self._populated(dev),
+                }
+            )
+
+    def results(self) -> list[dict]:
+        return self._partitions
+
+    def _geometry(self, dev: Path) -> dict[str, int | bool]:
+        if not dev.exists():
+            self._module.warn(f"{dev} does not exist yet, using default filesystem geometry")
+            return {}
+
+        block = self._sysfs / dev.resolve().name
+        parent = block.resolve().parent if (block / "partition").exists() else block.resolve()
+        queue = parent / "queue"
+        geometry: dict[str, int | bool] = {
+            "size": _read_int(block / "size") * 512,
+            "physical_block_size": _read_int(queue / "physical_block_size"),
+            "minimum_io_size": _read_int(queue / "minimum_io_size"),
+            "optimal_io_size": _read_int(queue / "optimal_io_size"),
+            "rotational": _read_int(queue / "rotational") == 1,
+            "nvme": parent.name.startswith("nvme"),
+            "chunk": 0,
+            "width": 0,
+        }
+
+        md = parent / "md"
+        if md.exists():
+            level = (md / "level").read_text(encoding="ascii").strip()
+            disks = _read_int(md / "raid_disks")
+            if level == "raid10":
+                layout = _read_int(md / "layout")
+                # the layout packs the near copies in the low byte and the far copies in the next one
+                data = disks // (max(layout & 0xFF, 1) * max(layout >> 8 & 0xFF, 1))
+            elif level in RAID_DATA_DISKS:
+                data = disks - RAID_DATA_DISKS[level]
+            else:
+                data = 0
+            if data > 1:
+                geometry["chunk"] = _read_int(md / "chunk_size")
+                geometry["width"] = data
+        elif geometry["optimal_io_size"] > geometry["minimum_io_size"] > 0:
+            # hardware RAID and some NVMe namespaces advertise their stripe through the I/O hints instead
+            if geometry["optimal_io_size"] % geometry["minimum_io_size"] == 0:
+                geometry["chunk"] = geometry["minimum_io_size"]
+                geometry["width"] = geometry["optimal_io_size"] // geometry["minimum_io_size"]
+        return geometry
+
+    def _populated(self, dev: str) -> bool:
+        if not Path(dev).exists():
+            return False
+        # low-level probing also catches partition tables and RAID superblocks that a cache lookup would miss
+        rc, out, _ = self._module.run_command([self._blkid, "-p", "-o", "export", dev])
+        return rc == 0 and any(line.startswith(("TYPE=", "PTTYPE=")) for line in out.splitlines())
+
+
+def _options(fstype: str, uuid: str | None, geometry: dict[str, int | bool]) -> list[str]:
+    options: list[str] = []
+    chunk, width = geometry.get("chunk", 0), geometry.get("width", 0)
+    solid = bool(geometry) and not geometry["rotational"]
+
+    if fstype in ("ext2", "ext3", "ext4"):
+        if uuid:
+            options.extend(("-U", uuid))
+        options.extend(("-b", str(BLOCK_SIZE)))
+        extended: list[str] = []
+        if chunk >= BLOCK_SIZE and width > 1:
+            stride = chunk // BLOCK_SIZE
+            extended.extend((f"stride={stride}", f"stripe_width={stride * width}"))
+        if solid:
+            # inode tables and the journal are zeroed in the background after mount instead of at mkfs time
+            extended.extend(("lazy_itable_init=1", "lazy_journal_init=1"))
+        if extended:
+            options.extend(("-E", ",".join(extended)))
+        if fstype != "ext2" and solid and geometry["size"] >= JOURNAL_THRESHOLD:
+            options.extend(("-J", f"size={JOURNAL_SIZE}"))
+    elif fstype == "xfs":
+        if uuid:
+            options.extend(("-m", f"uuid={uuid}"))
+        if chunk and width > 1:
+            options.extend(("-d", f"su={chunk},sw={width}"))
+        if geometry.get("physical_block_size", 0) > 512:
+            options.extend(("-s", f"size={geometry['physical_block_size']}"))
+    elif uuid:
+        options.extend(("-U", uuid))
+    return options
+
+
+def _read_int(path: Path) -> int:
+    return int(path.read_text(encoding="ascii").strip()) if path.exists() else 0
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "disks": {
+                "type": "dict",
+                "default": {},
+            },
+            "partitions": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+            },
+            "prefix": {
+                "type": "str",
+                "default": "/dev/disk/by-id/nvme-",
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    geometry = FilesystemGeometry(module, Path("/sys/class/block"))
+    geometry.populate()
+
+    module.exit_json(changed=False, partitions=geometry.results())
+
+
+if __name__ == "__main__":
+    _run_module()
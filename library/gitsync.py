@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+SHA_RE: Final[re.Pattern[str]] = re.compile(r"[0-9a-f]{40}|[0-9a-f]{64}")
+
+
+@final
+class GitSync:
+    __slots__ = ("_after", "_before", "_branches", "_git", "_module", "_remote", "_repos", "_seconds")
+
+    def __init__(self, module: AnsibleModule) -> None:
+        self._module = module
+        self._git = module.get_bin_path("git", required=True)
+        self._repos: dict[str, dict] = {
+            str(Path(entry["dest"]).expanduser()): entry for entry in module.params["repos"] or []
+        }
+        self._before: dict[str, str] = {}
+        self._after: dict[str, str] = {}
+        self._branches: set[str] = set()
+        self._remote: dict[str, str] = {}
+        self._seconds: dict[str, float] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "repositories",
+            "after": self._format(self._after),
+            "after_header": "repositories",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode:
+            return
+
+        pending = [dest for dest in self._repos if self._before[dest] != self._remote[dest]]
+        futures: dict[str, Future[None]] = {}
+        with ThreadPoolExecutor(self._module.params["jobs"]) as executor:
+            # parents are submitted first so a nested checkout never waits on a queued task
+            for dest in sorted(pending, key=lambda d: len(Path(d).parts)):
+                parent = next(
+                    (futures[p] for p in sorted(futures, key=len, reverse=True) if Path(dest).is_relative_to(p)),
+                    None,
+                )
+                futures[dest] = executor.submit(self._sync, dest, parent)
+
+        failures: dict[str, str] = {}
+        for dest, future in futures.items():
+            try:
+                future.result()
+            except RuntimeError as e:
+                failures[dest] = str(e)
+            self._after[dest] = self._head(dest)
+        if failures:
+            self._module.fail_json(msg="Failed to sync repositories", failures=failures, repos=self.results())
+
+    def populate(self) -> None:
+        with ThreadPoolExecutor(self._module.params["jobs"]) as executor:
+            futures = {dest: executor.submit(self._resolve, dest) for dest in self._repos}
+
+        failures: dict[str, str] = {}
+        for dest, future in futures.items():
+            try:
+                self._remote[dest] = self._after[dest] = future.result()
+            except RuntimeError as e:
+                failures[dest] = str(e)
+        if failures:
+            self._module.fail_json(msg="Failed to resolve repository versions", failures=failures)
+
+    def prepare(self) -> None:
+        for dest in self._repos:
+            self._before[dest] = self._head(dest)
+
+    def results(self) -> list[dict]:
+        after = {**self._before, **self._after}
+        return [
+            {
+                "dest": dest,
+                "repo": entry["repo"],
+                "version": entry["version"],
+                "before": self._before[dest],
+                "after": after[dest],
+                "changed": self._before[dest] != after[dest],
+                "seconds": round(self._seconds.get(dest, 0.0), 3),
+            }
+            for dest, entry in self._repos.items()
+        ]
+
+    def _clone(self, dest: str, entry: dict, bundle: str | None) -> None:
+        version: str = entry["version"]
+        args = ["clone", "--quiet"]
+        if not bundle:
+            args.extend(self._depth_args())
+            filter_spec: str | None = self._module.params["filter"]
+            if filter_spec:
+                args.append(f"--filter={filter_spec}")
+        if version != "HEAD" and not SHA_RE.fullmatch(version):
+            args.extend(("--branch", version))
+        self._run(*args, bundle or entry["repo"], dest)
+        if bundle:
+            self._run("-C", dest, "remote", "set-url", "origin", entry["repo"])
+        if SHA_RE.fullmatch(version):
+            self._run("-C", dest, "fetch", "--quiet", *self._depth_args(), bundle or "origin", version)
+            self._run("-C", dest, "checkout", "--quiet", "--detach", version)
+
+    def _depth_args(self) -> list[str]:
+        depth: int | None = self._module.params["depth"]
+        return [f"--depth={depth}"] if depth else []
+
+    def _format(self, state: dict[str, str]) -> str:
+        return "".join(f"{dest}: {sha}\n" for dest, sha in state.items() if sha)
+
+    def _head(self, dest: str) -> str:
+        if not (Path(dest) / ".git").exists():
+            return ""
+        rc, out, _ = self._module.run_command([self._git, "-C", dest, "rev-parse", "HEAD"])
+        return out.strip() if rc == 0 else ""
+
+    def _resolve(self, dest: str) -> str:
+        start = time.monotonic()
+        entry = self._repos[dest]
+        version: str = entry["version"]
+        if SHA_RE.fullmatch(version):
+            return version
+
+        # a controller-built bundle carries its own ref advertisement, so upstream is never contacted
+        if entry["bundle"]:
+            out = self._run("bundle", "list-heads", entry["bundle"])
+        else:
+            out = self._run("ls-remote", entry["repo"], version)
+        refs = {ref: sha for sha, ref in (line.split(maxsplit=1) for line in out.splitlines())}
+        self._seconds[dest] = time.monotonic() - start
+        if f"refs/heads/{version}" in refs:
+            self._branches.add(dest)
+        for ref in (version, f"refs/heads/{version}", f"refs/tags/{version}^{{}}", f"refs/tags/{version}"):
+            if ref in refs:
+                return refs[ref]
+        raise RuntimeError(f"{version} not found in {entry['repo']}")
+
+    def _run(self, *args: str) -> str:
+        rc, out, err = self._module.run_command([self._git, *args], environ_update={"GIT_TERMINAL_PROMPT": "0"})
+        if rc:
+            raise RuntimeError(f"git {' '.join(args)} failed ({rc}): {err.strip()}")
+        return out
+
+    def _sync(self, dest: str, parent: Future[None] | None) -> None:
+        if parent:
+            parent.result()
+
+        start = time.monotonic()
+        entry = self._repos[dest]
+        bundle: str | None = entry["bundle"]
+        if bundle:
+            try:
+                self._update(dest, entry, bundle)
+            except RuntimeError as e:
+                self._module.warn(f"{dest}: falling back to {entry['repo']} after bundle failure: {e}")
+                self._update(dest, entry, None)
+        else:
+            self._update(dest, entry, None)
+        if entry["recursive"] and (Path(dest) / ".gitmodules").exists():
+            self._run("-C", dest, "submodule", "--quiet", "update", "--init", "--recursive", *self._depth_args())
+        self._seconds[dest] = self._seconds.get(dest, 0.0) + time.monotonic() - start
+
+    def _update(self, dest: str, entry: dict, bundle: str | None) -> None:
+        if not (Path(dest) / ".git").exists():
+            self._clone(dest, entry, bundle)
+            return
+
+        version: str = entry["version"]
+        self._run("-C", dest, "remote", "set-url", "origin", entry["repo"])
+        if bundle:
+            self._run("-C", dest, "fetch", "--quiet", bundle, self._remote[dest])
+        else:
+            self._run("-C", dest, "fetch", "--quiet", *self._depth_args(), "origin", version)
+        if dest in self._branches:
+            self._run("-C", dest, "checkout", "--quiet", "-B", version, "FETCH_HEAD")
+        else:
+            self._run("-C", dest, "checkout", "--quiet", "--detach", "FETCH_HEAD")
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "repos": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "repo": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "dest": {
+                        "type": "path",
+                        "required": True,
+                    },
+                    "version": {
+                        "type": "str",
+                        "default": "HEAD",
+                    },
+                    "recursive": {
+                        "type": "bool",
+                        "default": True,
+                    },
+                    "bundle": {
+                        "type": "path",
+                    },
+                },
+            },
+            "depth": {
+                "type": "int",
+            },
+            "filter": {
+                "type": "str",
+                "default": "blob:none",
+            },
+            "jobs": {
+                "type": "int",
+                "default": 8,
+            },
+            "state": {
+                "type": "str",
+                "choices": ["query", "synced"],
+                "default": "synced",
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    sync = GitSync(module)
+    sync.prepare()
+    if module.params["state"] == "query":
+        module.exit_json(changed=False, repos=sync.results())
+
+    sync.populate()
+    sync.flush()
+
+    changed, diff = sync.diff()
+    module.exit_json(changed=changed, diff=diff, repos=sync.results())
+
+
+if __name__ == "__main__":
+    _run_module()
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+TIMER: Final[str] = "fstrim.timer"
+
+# options that drop write ordering guarantees, keyed by filesystem; XFS removed its variant in 4.19
+NOBARRIER: Final[dict[str, str]] = {
+    "ext3": "barrier=0",
+    "ext4": "barrier=0",
+    "btrfs": "nobarrier",
+}
+
+
+@final
+class MountOptions:
+    __slots__ = ("_after", "_before", "_module", "_partitions", "_sysfs")
+
+    def __init__(self, module: AnsibleModule, sysfs: Path) -> None:
+        self._module = module
+        self._sysfs = sysfs
+        self._before: dict[str, str] = {}
+        self._after: dict[str, str] = {}
+        self._partitions: list[dict] = []
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "mount options",
+            "after": self._format(self._after),
+            "after_header": "mount options",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode or self._before == self._after:
+            return
+
+        systemctl = self._module.get_bin_path("systemctl", required=True)
+        self._module.run_command([systemctl, "enable", "--now", TIMER], check_rc=True)
+
+    def populate(self) -> None:
+        disks: dict[str, str] = self._module.params["disks"]
+        trim: str = self._module.params["trim"]
+        timer = False
+        for item in self._module.params["partitions"]:
+            dev = f"{self._module.params['prefix']}{disks[item['disk']]}-part{item['partition']}"
+            fstype: str = item.get("filesystem") or "ext4"
+            device = self._class(Path(dev))
+            if item.get("options"):
+                # hand-written options in the inventory always win over the computed ones
+                options = item["options"]
+            else:
+                options = ",".join(self._options(fstype, device, item))
+            timer |= device != "hdd" and trim == "timer" and "discard" not in options.split(",")
+            self._partitions.append({**item, "dev": dev, "fstype": fstype, "class": device, "options": options})
+
+        # the timer is only ever switched on, other mounts on the host may rely on it as well
+        if timer:
+            self._after[f"unit {TIMER}"] = "enabled"
+
+    def prepare(self) -> None:
+        systemctl = self._module.get_bin_path("systemctl", required=True)
+        _, out, _ = self._module.run_command([systemctl, "is-enabled", TIMER])
+        self._before[f"unit {TIMER}"] = self._after[f"unit {TIMER}"] = (
+            "enabled" if out.strip() == "enabled" else "disabled"
+        )
+
+    def results(self) -> list[dict]:
+        return self._partitions
+
+    def _class(self, dev: Path) -> str:
+        if not dev.exists():
+            self._module.warn(f"{dev} does not exist yet, assuming ssd")
+            return "ssd"
+
+        block = self._sysfs / dev.resolve().name
+        parent = block.resolve().parent if (block / "partition").exists() else block.resolve()
+        names = [parent.name, *(slave.name for slave in (parent / "slaves").glob("*"))]
+        if any(name.startswith("nvme") for name in names):
+            return "nvme"
+        rotational = parent / "queue" / "rotational"
+        return "hdd" if rotational.exists() and rotational.read_text(encoding="ascii").strip() == "1" else "ssd"
+
+    def _format(self, state: dict[str, str]) -> str:
+        return "".join(f"{key}: {value}\n" for key, value in sorted(state.items()))
+
+    def _options(self, fstype: str, device: str, item: dict) -> list[str]:
+        options = [self._module.params["atime"]]
+        if self._module.params["lazytime"]:
+            options.append("lazytime")
+
+        solid = device != "hdd"
+        if fstype in ("ext3", "ext4") and solid and self._module.params["commit"]:
+            options.append(f"commit={self._module.params['commit']}")
+        if solid:
+            if self._module.params["trim"] == "online":
+                options.append("discard=async" if fstype == "btrfs" else "discard")
+            elif fstype == "btrfs":
+                # btrfs turns on asynchronous discard by itself on solid-state devices since 6.2
+                options.append("nodiscard")
+
+        if item.get("nobarrier"):
+            if not self._module.params["allow_nobarrier"]:
+                self._module.warn(f"{item['mountpoint']} asks for nobarrier, which allow_nobarrier does not permit")
+            elif fstype not in NOBARRIER:
+                self._module.warn(f"{fstype} on {item['mountpoint']} has no nobarrier option")
+            else:
+                options.append(NOBARRIER[fstype])
+        return options
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "disks": {
+                "type": "dict",
+                "default": {},
+            },
+            "partitions": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+            },
+            "prefix": {
+                "type": "str",
+                "default": "/dev/disk/by-id/nvme-",
+            },
+            "allow_nobarrier": {
+                "type": "bool",
+                "default": False,
+            },
+            "atime": {
+                "type": "str",
+                "choices": ["noatime", "relatime"],
+                "default": "noatime",
+            },
+            "commit": {
+                "type": "int",
+                "default": 30,
+            },
+            "lazytime": {
+                "type": "bool",
+                "default": True,
+            },
+            "trim": {
+                "type": "str",
+                "choices": ["timer", "online", "none"],
+                "default": "timer",
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    options = MountOptions(module, Path("/sys/class/block"))
+    options.prepare()
+    options.populate()
+    options.flush()
+
+    changed, diff = options.diff()
+    module.exit_json(changed=changed, diff=diff, partitions=options.results())
+
+
+if __name__ == "__main__":
+    _run_module()
@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import shutil
+import tempfile
 from pathlib import Path
-from typing import final
+from typing import Final, final
 
 import yaml
 from ansible.module_utils.basic import AnsibleModule
 
+INTERFACE_KINDS: Final[tuple[str, ...]] = ("ethernets", "bonds", "bridges", "vlans")
+
 
 @final
 class Netplan:
@@ -34,14 +37,17 @@ class Netplan:
             return
 
         for path, content in self._after.items():
+            if content == self._before.get(path):
+                continue
             if content:
                 path.write_text(content, encoding="utf-8")
                 path.chmod(0o600)
                 shutil.chown(path, self._fsowner, self._fsgroup)
+            else:
+                path.unlink(missing_ok=True)
 
     def populate(self) -> None:
-        ethernets: list[dict] = self._module.params["ethernets"] or []
-        if not ethernets:
+        if not any(self._module.params[kind] for kind in INTERFACE_KINDS):
             return
 
         network: dict = {"version": 2}
@@ -49,10 +55,16 @@ class Netplan:
         if renderer:
             network["renderer"] = renderer
 
-        network["ethernets"] = {}
-        for nic in ethernets:
-            name = nic.pop("name")
-            network["ethernets"][name] = _compact(nic)
+        for kind in INTERFACE_KINDS:
+            interfaces: list[dict] = self._module.params[kind] or []
+            if not interfaces:
+                continue
+            network[kind] = {}
+            for nic in interfaces:
+                name = nic.pop("name")
+                offloads: dict = nic.pop("offloads", None) or {}
+                nic.update((f"{k}_offload", v) for k, v in offloads.items())
+                network[kind][name] = _compact(nic)
 
         dest = self._configdir / "00-manual.yaml"
         self._after[dest] = yaml.dump(
@@ -71,8 +83,24 @@ class Netplan:
         for path in sorted(self._configdir.glob("*.yaml")):
             self._before[path] = path.read_text(encoding="utf-8")
             self._after[path] = ""
-            if not self._module.check_mode:
-                path.unlink()
+
+    def validate(self) -> None:
+        if _load(self._before) == _load(self._after):
+            self._after = dict(self._before)
+            return
+
+        netplan = self._module.get_bin_path("netplan", required=True)
+        with tempfile.TemporaryDirectory() as root:
+            configdir = Path(root) / self._configdir.relative_to(self._configdir.anchor)
+            configdir.mkdir(parents=True)
+            for path, content in self._after.items():
+                if content:
+                    dest = configdir / path.name
+                    dest.write_text(content, encoding="utf-8")
+                    dest.chmod(0o600)
+            rc, _, err = self._module.run_command([netplan, "generate", "--root-dir", root])
+            if rc:
+                self._module.fail_json(msg="netplan generate rejected the configuration", stderr=err)
 
     def _format(self, state: dict[Path, str]) -> str:
         return "".join(f"[{path}]\n{content}" for path, content in state.items() if content)
@@ -87,13 +115,91 @@ def _compact(obj: dict | list) -> dict | list:
             cleaned = _compact(v)
             if isinstance(cleaned, (dict, list)) and not cleaned:
                 continue
-            compacted[k] = cleaned
+            compacted[k.replace("_", "-")] = cleaned
         return compacted
     if isinstance(obj, list):
         return [_compact(item) for item in obj]
     return obj
 
 
+def _interface_options(**extra: dict) -> dict:
+    return {
+        "name": {
+            "type": "str",
+            "required": True,
+        },
+        "dhcp4": {
+            "type": "bool",
+        },
+        "dhcp6": {
+            "type": "bool",
+        },
+        "mtu": {
+            "type": "int",
+        },
+        "addresses": {
+            "type": "list",
+            "elements": "str",
+            "default": [],
+        },
+        "nameservers": {
+            "type": "dict",
+            "options": {
+                "addresses": {
+                    "type": "list",
+                    "elements": "str",
+                    "default": [],
+                },
+                "search": {
+                    "type": "list",
+                    "elements": "str",
+                    "default": [],
+                },
+            },
+        },
+        "routes": {
+            "type": "list",
+            "elements": "dict",
+            "default": [],
+            "options": {
+                "to": {
+                    "type": "str",
+                    "required": True,
+                },
+                "via": {
+                    "type": "str",
+                    "required": True,
+                },
+                "metric": {
+                    "type": "int",
+                },
+            },
+        },
+        **extra,
+    }
+
+
+def _load(state: dict[Path, str]) -> dict[Path, object]:
+    loaded: dict[Path, object] = {}
+    for path, content in state.items():
+        if content:
+            try:
+                loaded[path] = _normalise(yaml.safe_load(content))
+            except yaml.YAMLError:
+                loaded[path] = content
+    return loaded
+
+
+def _normalise(obj: object, key: str | None = None) -> object:
+    if isinstance(obj, dict):
+        return {str(k): _normalise(v, str(k)) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_normalise(item) for item in obj]
+    if key == "macaddress" and isinstance(obj, str):
+        return obj.lower()
+    return obj
+
+
 def _run_module() -> None:
     module = AnsibleModule(
         argument_spec={
@@ -101,59 +207,121 @@ def _run_module() -> None:
                 "type": "list",
                 "elements": "dict",
                 "default": [],
-                "options": {
-                    "name": {
+                "options": _interface_options(
+                    macaddress={
                         "type": "str",
-                        "required": True,
-                    },
-                    "dhcp4": {
-                        "type": "bool",
                     },
-                    "dhcp6": {
-                        "type": "bool",
-                    },
-                    "macaddress": {
-                        "type": "str",
+                    offloads={
+                        "type": "dict",
+                        "options": {
+                            name: {
+                                "type": "bool",
+                            }
+                            for name in (
+                                "receive_checksum",
+                                "transmit_checksum",
+                                "tcp_segmentation",
+                                "tcp6_segmentation",
+                                "generic_segmentation",
+                                "generic_receive",
+                                "large_receive",
+                            )
+                        },
                     },
-                    "addresses": {
+                ),
+            },
+            "bonds": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": _interface_options(
+                    interfaces={
                         "type": "list",
                         "elements": "str",
-                        "default": [],
+                        "required": True,
                     },
-                    "nameservers": {
+                    parameters={
                         "type": "dict",
                         "options": {
-                            "addresses": {
-                                "type": "list",
-                                "elements": "str",
-                                "default": [],
+                            "mode": {
+                                "type": "str",
+                                "choices": [
+                                    "balance-rr",
+                                    "active-backup",
+                                    "balance-xor",
+                                    "broadcast",
+                                    "802.3ad",
+                                    "balance-tlb",
+                                    "balance-alb",
+                                ],
+                            },
+                            "lacp_rate": {
+                                "type": "str",
+                                "choices": ["slow", "fast"],
+                            },
+                            "mii_monitor_interval": {
+                                "type": "str",
                             },
-                            "search": {
-                                "type": "list",
-                                "elements": "str",
-                                "default": [],
+                            "min_links": {
+                                "type": "int",
+                            },
+                            "transmit_hash_policy": {
+                                "type": "str",
+                                "choices": ["layer2", "layer2+3", "layer3+4", "encap2+3", "encap3+4"],
+                            },
+                            "primary": {
+                                "type": "str",
+                            },
+                            "up_delay": {
+                                "type": "str",
+                            },
+                            "down_delay": {
+                                "type": "str",
                             },
                         },
                     },
-                    "routes": {
+                ),
+            },
+            "bridges": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": _interface_options(
+                    interfaces={
                         "type": "list",
-                        "elements": "dict",
+                        "elements": "str",
                         "default": [],
+                    },
+                    parameters={
+                        "type": "dict",
                         "options": {
-                            "to": {
-                                "type": "str",
-                                "required": True,
+                            "stp": {
+                                "type": "bool",
                             },
-                            "via": {
+                            "forward_delay": {
                                 "type": "str",
-                                "required": True,
                             },
-                            "metric": {
+                            "priority": {
                                 "type": "int",
                             },
                         },
                     },
-                },
+                ),
+            },
+            "vlans": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": _interface_options(
+                    id={
+                        "type": "int",
+                        "required": True,
+                    },
+                    link={
+                        "type": "str",
+                        "required": True,
+                    },
+                ),
             },
             "renderer": {
                 "type": "str",
@@ -166,6 +334,7 @@ def _run_module() -> None:
     plan = Netplan(module, Path("/etc/netplan"), "root", "root")
     plan.prepare()
     plan.populate()
+    plan.validate()
     plan.flush()
 
     changed, diff = plan.diff()
@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import shutil
+import socket
+import tempfile
+import time
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+BASE_OPTIONS: Final[tuple[str, ...]] = (
+    "_netdev",
+    "nodev",
+    "nofail",
+    "nosuid",
+    "proto=tcp",
+    "retrans=3",
+    "soft",
+    "timeo=600",
+)
+
+# fail fast while probing, a version the server does not speak must not hang for minutes
+PROBE_OPTIONS: Final[tuple[str, ...]] = ("proto=tcp", "retry=0", "retrans=1", "soft", "timeo=50")
+
+CHUNK: Final[int] = 1024 * 1024
+
+
+@final
+class NFSTune:
+    __slots__ = ("_after", "_before", "_fsgroup", "_fsowner", "_module", "_shares", "_statedir")
+
+    def __init__(self, module: AnsibleModule, statedir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._statedir = statedir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._before: dict[str, dict] = {}
+        self._after: dict[str, dict] = {}
+        self._shares: dict[str, dict] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "nfs tuning",
+            "after": self._format(self._after),
+            "after_header": "nfs tuning",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode or self._before == self._after:
+            return
+
+        if not self._statedir.exists():
+            self._statedir.mkdir(mode=0o755, parents=True)
+            shutil.chown(self._statedir, self._fsowner, self._fsgroup)
+        path = self._statedir / "state.json"
+        path.write_text(json.dumps(self._after, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        path.chmod(0o644)
+        shutil.chown(path, self._fsowner, self._fsgroup)
+
+    def populate(self) -> None:
+        nconnect = self._module.params["nconnect"] if _nconnect_supported() else [1]
+        for src in self._shares:
+            cached = self._before.get(src)
+            if cached and not self._module.params["refresh"]:
+                self._after[src] = cached
+                continue
+            if self._module.check_mode:
+                self._module.warn(f"{src} has not been probed yet, the server picks the NFS version on mount")
+                continue
+
+            version = self._negotiate(src)
+            if version is None:
+                self._module.warn(f"{src} could not be mounted with any of the configured NFS versions")
+                continue
+            # without a measurement the kernel default of a single connection is kept, extra ones cost server slots
+            if self._module.params["benchmark"]:
+                self._after[src] = self._benchmark(src, version, nconnect) or {**version, "nconnect": 1}
+            else:
+                self._after[src] = {**version, "nconnect": 1}
+            self._after[src]["measured"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+
+        for src, share in self._shares.items():
+            mounted = share["mounted"]
+            tuned = self._after.get(src)
+            if not mounted or not tuned:
+                continue
+            if mounted.get("vers") != tuned["vers"] or mounted.get("nconnect", "1") != str(tuned["nconnect"]):
+                # NFS refuses to change the version or connection count on remount
+                self._module.warn(f"{share['path']} is mounted with other transport options and needs a full remount")
+
+    def prepare(self) -> None:
+        path = self._statedir / "state.json"
+        state: dict[str, dict] = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        mounts = _mounts()
+        for share in self._module.params["shares"]:
+            self._shares[share["src"]] = {**share, "mounted": mounts.get(share["path"])}
+            if share["src"] in state:
+                self._before[share["src"]] = state[share["src"]]
+
+    def results(self) -> list[dict]:
+        shares: list[dict] = []
+        for src, share in self._shares.items():
+            options = [*BASE_OPTIONS, *share["options"]]
+            tuned = self._after.get(src)
+            if tuned:
+                options.append(f"nfsvers={tuned['vers']}")
+                if tuned["nconnect"] > 1:
+                    options.append(f"nconnect={tuned['nconnect']}")
+                options.extend((f"rsize={tuned['rsize']}", f"wsize={tuned['wsize']}"))
+            shares.append({"path": share["path"], "src": src, "options": ",".join(options), "tuning": tuned or {}})
+        return shares
+
+    def _benchmark(self, src: str, version: dict, nconnect: list[int]) -> dict | None:
+        size: int = self._module.params["benchmark_size"]
+        name = f".nfstune-{socket.gethostname()}-{os.getpid()}"
+        best: dict | None = None
+        for connections in sorted(set(nconnect)):
+            for block in sorted(set(self._module.params["block_sizes"]), reverse=True):
+                options = [f"nfsvers={version['vers']}", f"rsize={block}", f"wsize={block}"]
+                if connections > 1:
+                    options.append(f"nconnect={connections}")
+                try:
+                    with _Mount(self._module, src, options) as (mountpoint, _):
+                        try:
+                            write = _write(Path(mountpoint, name), size)
+                        except OSError:
+                            Path(mountpoint, name).unlink(missing_ok=True)
+                            raise
+                    # a fresh mount starts with a cold page cache, so the read really crosses the wire
+                    with _Mount(self._module, src, options) as (mountpoint, negotiated):
+                        try:
+                            read = _read(Path(mountpoint, name))
+                        finally:
+                            Path(mountpoint, name).unlink(missing_ok=True)
+                except OSError as e:
+                    self._module.warn(f"benchmark of {src} with {','.join(options)} failed: {e}")
+                    continue
+
+                result = {
+                    "vers": version["vers"],
+                    "nconnect": connections,
+                    "rsize": int(negotiated.get("rsize", block)),
+                    "wsize": int(negotiated.get("wsize", block)),
+                    "read_mbps": round(size / read, 1),
+                    "write_mbps": round(size / write, 1),
+                }
+                # more connections only win when they are clearly faster, every extra one costs a server slot
+                if best is None or read + write < 0.95 * (size / best["read_mbps"] + size / best["write_mbps"]):
+                    best = result
+        return best
+
+    def _format(self, state: dict[str, dict]) -> str:
+        return "".join(
+            f"[{src}] {key}: {value}\n"
+            for src, tuning in sorted(state.items())
+            for key, value in sorted(tuning.items())
+            if key != "measured"
+        )
+
+    def _negotiate(self, src: str) -> dict | None:
+        for version in self._module.params["versions"]:
+            try:
+                with _Mount(self._module, src, [f"nfsvers={version}"]) as (_, negotiated):
+                    return {
+                        "vers": negotiated.get("vers", version),
+                        "rsize": int(negotiated.get("rsize", CHUNK)),
+                        "wsize": int(negotiated.get("wsize", CHUNK)),
+                    }
+            except OSError:
+                continue
+        return None
+
+
+@final
+class _Mount:
+    __slots__ = ("_module", "_mountpoint", "_options", "_src")
+
+    def __init__(self, module: AnsibleModule, src: str, options: list[str]) -> None:
+        self._module = module
+        self._src = src
+        self._options = options
+        self._mountpoint = ""
+
+    def __enter__(self) -> tuple[str, dict[str, str]]:
+        self._mountpoint = tempfile.mkdtemp(prefix="nfstune-")
+        mount = self._module.get_bin_path("mount", required=True)
+        options = ",".join((*PROBE_OPTIONS, *self._options))
+        rc, _, err = self._module.run_command([mount, "-t", "nfs", "-o", options, self._src, self._mountpoint])
+        if rc != 0:
+            os.rmdir(self._mountpoint)
+            raise OSError(err.strip())
+        return self._mountpoint, _mounts().get(self._mountpoint, {})
+
+    def __exit__(self, *_: object) -> None:
+        umount = self._module.get_bin_path("umount", required=True)
+        self._module.run_command([umount, self._mountpoint], check_rc=True)
+        os.rmdir(self._mountpoint)
+
+
+def _mounts() -> dict[str, dict[str, str]]:
+    mounts: dict[str, dict[str, str]] = {}
+    for line in Path("/proc/mounts").read_text(encoding="utf-8").splitlines():
+        fields = line.split()
+        if len(fields) > 3 and fields[2].startswith("nfs"):
+            mounts[fields[1]] = dict(option.partition("=")[::2] for option in fields[3].split(","))
+    return mounts
+
+
+def _nconnect_supported() -> bool:
+    # releases such as 6.8.0-45-generic or 5.15.0+ carry suffixes that a plain split would choke on
+    match = re.match(r"(\d+)\.(\d+)", os.uname().release)
+    return match is not None and (int(match.group(1)), int(match.group(2))) >= (5, 3)
+
+
+def _read(path: Path) -> float:
+    start = time.monotonic()
+    with path.open("rb", buffering=0) as f:
+        while f.read(CHUNK):
+            pass
+    return time.monotonic() - start
+
+
+def _write(path: Path, size: int) -> float:
+    block = os.urandom(CHUNK)
+    start = time.monotonic()
+    with path.open("wb", buffering=0) as f:
+        for _ in range(size):
+            f.write(block)
+        os.fsync(f.fileno())
+    return time.monotonic() - start
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "shares": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "path": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "src": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "options": {
+                        "type": "list",
+                        "elements": "str",
+                        "default": [],
+                    },
+                },
+            },
+            "benchmark": {
+                "type": "bool",
+                "default": False,
+            },
+            "benchmark_size": {
+                "type": "int",
+                "default": 256,
+            },
+            "block_sizes": {
+                "type": "list",
+                "elements": "int",
+                "default": [1048576, 262144],
+            },
+            "nconnect": {
+                "type": "list",
+                "elements": "int",
+                "default": [1, 2, 4, 8],
+            },
+            "refresh": {
+                "type": "bool",
+                "default": False,
+            },
+            "versions": {
+                "type": "list",
+                "elements": "str",
+                "default": ["4.2", "4.1", "4.0", "3"],
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    tune = NFSTune(module, Path("/var/lib/nfstune"), "root", "root")
+    tune.prepare()
+    tune.populate()
+    tune.flush()
+
+    changed, diff = tune.diff()
+    module.exit_json(changed=changed, diff=diff, shares=tune.results())
+
+
+if __name__ == "__main__":
+    _run_module()
@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import re
+import shutil
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+ETHTOOL_GROUPS: Final[dict[str, tuple[str, str]]] = {
+    "rings": ("-g", "-G"),
+    "channels": ("-l", "-L"),
+    "coalesce": ("-c", "-C"),
+}
+
+
+@final
+class NICTune:
+    __slots__ = (
+        "_after",
+        "_before",
+        "_ethtool",
+        "_fsgroup",
+        "_fsowner",
+        "_module",
+        "_unitdir",
+        "_units_after",
+        "_units_before",
+    )
+
+    def __init__(self, module: AnsibleModule, unitdir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._unitdir = unitdir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._ethtool = module.get_bin_path("ethtool", required=True)
+        self._before: dict[str, dict[str, str]] = {}
+        self._after: dict[str, dict[str, str]] = {}
+        self._units_before: dict[Path, str] = {}
+        self._units_after: dict[Path, str] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after or self._units_before != self._units_after, {
+            "before": self._format(self._before, self._units_before),
+            "before_header": "nic settings",
+            "after": self._format(self._after, self._units_after),
+            "after_header": "nic settings",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode:
+            return
+
+        for name, settings in self._after.items():
+            current = self._before[name]
+            for group, (_, setter) in ETHTOOL_GROUPS.items():
+                args = [
+                    word
+                    for key, value in settings.items()
+                    if key.startswith(f"{group}.") and current.get(key) != value
+                    for word in (key.partition(".")[2], value)
+                ]
+                if args:
+                    self._module.run_command([self._ethtool, setter, name, *args], check_rc=True)
+            for key, value in settings.items():
+                if not key.startswith("irq.") or current.get(key) == value:
+                    continue
+                # kernel-managed MSI-X vectors refuse affinity changes, the persisted unit ignores those as well
+                try:
+                    Path("/proc/irq", key.partition(".")[2], "smp_affinity_list").write_text(value, encoding="ascii")
+                except OSError as e:
+                    self._module.warn(f"IRQ {key.partition('.')[2]} of {name} rejected affinity {value}: {e}")
+
+        if self._units_before == self._units_after:
+            return
+
+        systemctl = self._module.get_bin_path("systemctl", required=True)
+        for path in self._units_before.keys() - self._units_after.keys():
+            self._module.run_command([systemctl, "disable", path.name], check_rc=True)
+            path.unlink()
+        for path, content in self._units_after.items():
+            if content != self._units_before.get(path):
+                path.write_text(content, encoding="utf-8")
+                path.chmod(0o644)
+                shutil.chown(path, self._fsowner, self._fsgroup)
+        self._module.run_command([systemctl, "daemon-reload"], check_rc=True)
+        for path in self._units_after:
+            self._module.run_command([systemctl, "enable", path.name], check_rc=True)
+
+    def populate(self) -> None:
+        interfaces: list[dict] = self._module.params["interfaces"] or []
+        for nic in interfaces:
+            name: str = nic["name"]
+            desired: dict[str, str] = {}
+            for group in ETHTOOL_GROUPS:
+                for key, value in (nic[group] or {}).items():
+                    if value is not None:
+                        desired[f"{group}.{key.replace('_', '-')}"] = _ethtool_value(value)
+
+            current = self._read(name, {key.partition(".")[0] for key in desired})
+            irqs = sorted(path.name for path in Path("/sys/class/net", name, "device", "msi_irqs").glob("*"))
+            cpus: list[int] = nic["irq_cpus"]
+            if cpus:
+                for i, irq in enumerate(irqs):
+                    try:
+                        current[f"irq.{irq}"] = Path("/proc/irq", irq, "smp_affinity_list").read_text("ascii").strip()
+                    except OSError as e:
+                        self._module.warn(f"cannot read the affinity of IRQ {irq} of {name}: {e}")
+                        continue
+                    desired[f"irq.{irq}"] = str(cpus[i % len(cpus)])
+
+            self._before[name] = {key: current.get(key, "") for key in desired}
+            self._after[name] = desired
+
+            if self._module.params["persist"] and (desired or cpus):
+                self._units_after[self._unitdir / f"nictune-{name}.service"] = self._unit(name, desired, cpus)
+
+        if any(nic["irq_cpus"] for nic in interfaces):
+            systemctl = self._module.get_bin_path("systemctl")
+            if systemctl and self._module.run_command([systemctl, "is-active", "--quiet", "irqbalance"])[0] == 0:
+                self._module.warn("irqbalance is active and may override the configured IRQ affinity")
+
+    def prepare(self) -> None:
+        for path in sorted(self._unitdir.glob("nictune-*.service")):
+            self._units_before[path] = path.read_text(encoding="utf-8")
+
+    def _format(self, state: dict[str, dict[str, str]], units: dict[Path, str]) -> str:
+        settings = "".join(
+            f"[{name}] {key}: {value}\n" for name, values in state.items() for key, value in values.items()
+        )
+        return settings + "".join(f"[{path}]\n{content}" for path, content in units.items())
+
+    def _read(self, name: str, groups: set[str]) -> dict[str, str]:
+        current: dict[str, str] = {}
+        for group in groups:
+            getter = ETHTOOL_GROUPS[group][0]
+            _, out, _ = self._module.run_command([self._ethtool, getter, name], check_rc=True)
+            if group == "coalesce":
+                adaptive = re.search(r"Adaptive RX:\s*(\S+)\s+TX:\s*(\S+)", out)
+                if adaptive:
+                    current["coalesce.adaptive-rx"], current["coalesce.adaptive-tx"] = adaptive.groups()
+            else:
+                out = out.partition("Current hardware settings:")[2]
+            for line in out.splitlines():
+                key, sep, value = line.partition(":")
+                if sep and value.strip():
+                    current.setdefault(f"{group}.{key.strip().lower().replace(' ', '-')}", value.strip())
+        return current
+
+    def _unit(self, name: str, desired: dict[str, str], cpus: list[int]) -> str:
+        lines = [
+            "[Unit]\n",
+            f"Description=NIC tuning for {name}\n",
+            f"BindsTo=sys-subsystem-net-devices-{name}.device\n",
+            f"After=sys-subsystem-net-devices-{name}.device\n",
+            "Before=network-pre.target\n",
+            "Wants=network-pre.target\n",
+            "\n",
+            "[Service]\n",
+            "Type=oneshot\n",
+            "RemainAfterExit=yes\n",
+        ]
+        for group, (_, setter) in ETHTOOL_GROUPS.items():
+            args = "".join(f" {k.partition('.')[2]} {v}" for k, v in desired.items() if k.startswith(f"{group}."))
+            if args:
+                lines.append(f"ExecStart={self._ethtool} {setter} {name}{args}\n")
+        if cpus:
+            cpulist = " ".join(map(str, cpus))
+            lines.append(
+                f"ExecStart=-/bin/sh -c 'set -- {cpulist}; "
+                f"for irq in /sys/class/net/{name}/device/msi_irqs/*; do [ $$# -gt 0 ] || set -- {cpulist}; "
+                "echo $$1 > /proc/irq/$${irq##*/}/smp_affinity_list; shift; done'\n"
+            )
+        lines.extend(("\n", "[Install]\n", f"WantedBy=sys-subsystem-net-devices-{name}.device\n"))
+        return "".join(lines)
+
+
+def _ethtool_value(value: object) -> str:
+    if isinstance(value, bool):
+        return "on" if value else "off"
+    return str(value)
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "interfaces": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "name": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "rings": {
+                        "type": "dict",
+                        "options": {
+                            "rx": {
+                                "type": "int",
+                            },
+                            "tx": {
+                                "type": "int",
+                            },
+                        },
+                    },
+                    "channels": {
+                        "type": "dict",
+                        "options": {
+                            "rx": {
+                                "type": "int",
+                            },
+                            "tx": {
+                                "type": "int",
+                            },
+                            "other": {
+                                "type": "int",
+                            },
+                            "combined": {
+                                "type": "int",
+                            },
+                        },
+                    },
+                    "coalesce": {
+                        "type": "dict",
+                        "options": {
+                            "adaptive_rx": {
+                                "type": "bool",
+                            },
+                            "adaptive_tx": {
+                                "type": "bool",
+                            },
+                            "rx_usecs": {
+                                "type": "int",
+                            },
+                            "rx_frames": {
+                                "type": "int",
+                            },
+                            "tx_usecs": {
+                                "type": "int",
+                            },
+                            "tx_frames": {
+                                "type": "int",
+                            },
+                        },
+                    },
+                    "irq_cpus": {
+                        "type": "list",
+                        "elements": "int",
+                        "default": [],
+                    },
+                },
+            },
+            "persist": {
+                "type": "bool",
+                "default": True,
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    tune = NICTune(module, Path("/etc/systemd/system"), "root", "root")
+    tune.prepare()
+    tune.populate()
+    tune.flush()
+
+    changed, diff = tune.diff()
+    module.exit_json(changed=changed, diff=diff)
+
+
+if __name__ == "__main__":
+    _run_module()
@@ -0,0 +1,291 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import secrets
+import shutil
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+UNIT: Final[Path] = Path("/etc/systemd/system/pgbouncer@.service")
+
+UNIT_CONTENT: Final[str] = """[Unit]
+Description=connection pooler for PostgreSQL cluster %i
+After=network.target postgresql@%i.service
+
+[Service]
+Type=notify
+User=postgres
+ExecStart=/usr/sbin/pgbouncer /etc/pgbouncer/%i.ini
+ExecReload=/bin/kill -HUP $MAINPID
+KillSignal=SIGINT
+LimitNOFILE=65536
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+AUTH_FUNCTION: Final[str] = """CREATE SCHEMA IF NOT EXISTS pgbouncer;
+CREATE OR REPLACE FUNCTION pgbouncer.get_auth(p_usename text)
+RETURNS TABLE (username text, password text)
+LANGUAGE sql SECURITY DEFINER SET search_path = pg_catalog AS $$
+    SELECT rolname::text, rolpassword::text FROM pg_authid
+    WHERE rolname = p_usename AND rolcanlogin AND NOT rolsuper
+        AND (rolvaliduntil IS NULL OR rolvaliduntil > now())
+$$;
+REVOKE ALL ON FUNCTION pgbouncer.get_auth(text) FROM PUBLIC;
+GRANT USAGE ON SCHEMA pgbouncer TO :"user";
+GRANT EXECUTE ON FUNCTION pgbouncer.get_auth(text) TO :"user";
+"""
+
+
+@final
+class PgBouncer:
+    __slots__ = ("_after", "_before", "_confdir", "_fsgroup", "_fsowner", "_instances", "_module")
+
+    def __init__(self, module: AnsibleModule, confdir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._confdir = confdir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._before: dict[str, str] = {}
+        self._after: dict[str, str] = {}
+        self._instances: dict[str, dict] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "pgbouncer",
+            "after": self._format(self._after),
+            "after_header": "pgbouncer",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode or self._before == self._after:
+            return
+
+        systemctl = self._module.get_bin_path("systemctl", required=True)
+        if self._before["unit pgbouncer.service"] != self._after["unit pgbouncer.service"]:
+            # the packaged instance listens on 6432, which the per-cluster convention hands to port 5432
+            self._module.run_command([systemctl, "disable", "--now", "pgbouncer.service"], check_rc=True)
+
+        for key, content in self._after.items():
+            if not key.startswith("/") or content == self._before.get(key):
+                continue
+            path = Path(key)
+            path.write_text(content, encoding="utf-8")
+            if path == UNIT:
+                path.chmod(0o644)
+                shutil.chown(path, "root", "root")
+            else:
+                path.chmod(0o640)
+                shutil.chown(path, self._fsowner, self._fsgroup)
+        if self._before.get(str(UNIT)) != self._after[str(UNIT)]:
+            self._module.run_command([systemctl, "daemon-reload"], check_rc=True)
+
+        for instance, state in self._instances.items():
+            entry: dict = state["entry"]
+            userlist = str(state["userlist"])
+            if self._before[userlist] != self._after[userlist]:
+                self._auth_role(entry, state["password"])
+            self._psql(entry, AUTH_FUNCTION, entry["auth_dbname"], user=entry["auth_user"])
+            unit = f"pgbouncer@{instance}.service"
+            files = (str(state["ini"]), str(state["userlist"]))
+            if self._before[f"unit {unit}"] != "active":
+                self._module.run_command([systemctl, "enable", "--now", unit], check_rc=True)
+            elif any(self._before.get(path) != self._after[path] for path in files):
+                if _listen_port(self._before.get(files[0], "")) != _listen_port(self._after[files[0]]):
+                    self._module.warn(f"{unit} changed its listen port and needs a restart to pick it up")
+                # SIGHUP reloads pools and settings without dropping connected clients
+                self._module.run_command([systemctl, "reload", unit], check_rc=True)
+
+    def populate(self) -> None:
+        if not self._instances:
+            return
+
+        self._after[str(UNIT)] = UNIT_CONTENT
+        self._after["unit pgbouncer.service"] = "disabled"
+        cores = os.cpu_count() or 1
+        for instance, state in self._instances.items():
+            entry: dict = state["entry"]
+            max_connections: int = state["max_connections"]
+            budget = max(max_connections - entry["reserved_connections"], 1)
+            pool_size = entry["default_pool_size"] or min(2 * cores + 1, budget)
+
+            settings = {
+                "listen_addr": entry["listen_addr"],
+                "listen_port": str(entry["listen_port"] or state["port"] + 1000),
+                "unix_socket_dir": "/var/run/postgresql",
+                "auth_type": "scram-sha-256",
+                "auth_file": str(state["userlist"]),
+                "auth_user": entry["auth_user"],
+                "auth_dbname": entry["auth_dbname"],
+                "auth_query": "SELECT username, password FROM pgbouncer.get_auth($1)",
+                "pool_mode": entry["pool_mode"],
+                "default_pool_size": str(pool_size),
+                "reserve_pool_size": str(max(pool_size // 4, 1)),
+                "max_db_connections": str(budget),
+                "max_client_conn": str(entry["max_client_conn"]),
+                "server_reset_query": "DISCARD ALL" if entry["pool_mode"] == "session" else "",
+                "max_prepared_statements": "200" if entry["pool_mode"] == "transaction" else "0",
+                "ignore_startup_parameters": "extra_float_digits,options",
+            }
+            self._after[str(state["ini"])] = (
+                "[databases]\n"
+                f"* = host=127.0.0.1 port={state['port']}\n"
+                "\n"
+                "[pgbouncer]\n" + "".join(f"{key} = {value}".rstrip() + "\n" for key, value in settings.items())
+            )
+            self._after[str(state["userlist"])] = f'"{entry["auth_user"]}" "{state["password"]}"\n'
+            self._after[f"unit pgbouncer@{instance}.service"] = "active"
+
+    def prepare(self) -> None:
+        systemctl = self._module.get_bin_path("systemctl", required=True)
+        self._before[str(UNIT)] = UNIT.read_text(encoding="utf-8") if UNIT.exists() else ""
+        self._after[str(UNIT)] = self._before[str(UNIT)]
+        _, out, _ = self._module.run_command([systemctl, "is-enabled", "pgbouncer.service"])
+        enabled = "enabled" if out.strip() == "enabled" else "disabled"
+        self._before["unit pgbouncer.service"] = self._after["unit pgbouncer.service"] = enabled
+
+        pg_lsclusters = self._module.get_bin_path("pg_lsclusters", required=True)
+        for entry in self._module.params["clusters"] or []:
+            instance = f"{entry['version']}-{entry['name']}"
+            conf = Path("/etc/postgresql", entry["version"], entry["name"], "postgresql.conf")
+            _, out, _ = self._module.run_command([pg_lsclusters, "--no-header", entry["version"], entry["name"]])
+            if not conf.exists() or "online" not in out.split():
+                self._module.warn(f"cluster {entry['version']}/{entry['name']} is not running and was skipped")
+                continue
+
+            state = {
+                "entry": entry,
+                "ini": self._confdir / f"{instance}.ini",
+                "userlist": self._confdir / f"{instance}.userlist",
+                "port": int(_setting(conf, "port") or 5432),
+            }
+            for path in (state["ini"], state["userlist"]):
+                self._before[str(path)] = path.read_text(encoding="utf-8") if path.exists() else ""
+            _, out, _ = self._module.run_command([systemctl, "is-active", f"pgbouncer@{instance}.service"])
+            self._before[f"unit pgbouncer@{instance}.service"] = out.strip() or "inactive"
+
+            state["max_connections"] = int(self._psql(entry, "SHOW max_connections;"))
+            state["password"] = _password(self._before[str(state["userlist"])], entry["auth_user"])
+            self._instances[instance] = state
+
+    def _auth_role(self, entry: dict, password: str) -> None:
+        user: str = entry["auth_user"]
+        exists = self._psql(entry, "SELECT 1 FROM pg_roles WHERE rolname = :'user';", user=user)
+        sql = (
+            "ALTER ROLE :\"user\" PASSWORD :'password';"
+            if exists
+            else "CREATE ROLE :\"user\" LOGIN PASSWORD :'password';"
+        )
+        self._psql(entry, sql, user=user, password=password)
+
+    def _format(self, state: dict[str, str]) -> str:
+        files = "".join(f"[{key}]\n{value}" for key, value in sorted(state.items()) if key.startswith("/") and value)
+        units = "".join(f"{key}: {value}\n" for key, value in sorted(state.items()) if key.startswith("unit "))
+        return re.sub(r'^("[^"]+") "[^"]*"$', r'\1 "<redacted>"', files, flags=re.MULTILINE) + units
+
+    def _psql(self, entry: dict, sql: str, database: str = "postgres", **variables: str) -> str:
+        runuser = self._module.get_bin_path("runuser", required=True)
+        argv = [runuser, "-u", "postgres", "--", "psql", "--cluster", f"{entry['version']}/{entry['name']}"]
+        argv.extend(("-X", "-q", "-A", "-t", "-v", "ON_ERROR_STOP=1", "-d", database))
+        # variables are set on stdin rather than argv, which any local user can read from /proc/<pid>/cmdline
+        script = "".join(f"\\set {name} '{_quote(value)}'\n" for name, value in variables.items()) + sql
+        _, out, _ = self._module.run_command(argv, data=script, check_rc=True)
+        return out.strip()
+
+
+def _listen_port(content: str) -> str | None:
+    match = re.search(r"^listen_port = (\d+)$", content, re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def _password(userlist: str, user: str) -> str:
+    match = re.search(rf'^"{re.escape(user)}" "([^"]*)"$', userlist, re.MULTILINE)
+    # the auth_query connection has no client exchange to pass through, so pgbouncer needs the cleartext password
+    if match and not match.group(1).startswith(("SCRAM-SHA-256$", "md5")):
+        return match.group(1)
+    return secrets.token_urlsafe(32)
+
+
+def _quote(value: str) -> str:
+    # psql meta-command arguments treat backslashes as escapes and double single quotes
+    return value.replace("\\", "\\\\").replace("'", "''")
+
+
+def _setting(conf: Path, key: str) -> str | None:
+    pattern = rf"^\s*{re.escape(key)}\s*=\s*(?:'([^']*)'|([^\s#]+))"
+    match = re.search(pattern, conf.read_text(encoding="utf-8"), re.MULTILINE)
+    if not match:
+        return None
+    return match.group(1) if match.group(1) is not None else match.group(2)
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "clusters": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "version": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "name": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "listen_addr": {
+                        "type": "str",
+                        "default": "*",
+                    },
+                    "listen_port": {
+                        "type": "int",
+                    },
+                    "pool_mode": {
+                        "type": "str",
+                        "choices": ["session", "transaction", "statement"],
+                        "default": "transaction",
+                    },
+                    "default_pool_size": {
+                        "type": "int",
+                    },
+                    "reserved_connections": {
+                        "type": "int",
+                        "default": 10,
+                    },
+                    "max_client_conn": {
+                        "type": "int",
+                        "default": 5000,
+                    },
+                    "auth_user": {
+                        "type": "str",
+                        "default": "pgbouncer",
+                    },
+                    "auth_dbname": {
+                        "type": "str",
+                        "default": "postgres",
+                    },
+                },
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    bouncer = PgBouncer(module, Path("/etc/pgbouncer"), "postgres", "postgres")
+    bouncer.prepare()
+    bouncer.populate()
+    bouncer.flush()
+
+    changed, diff = bouncer.diff()
+    module.exit_json(changed=changed, diff=diff)
+
+
+if __name__ == "__main__":
+    _run_module()
@@ -0,0 +1,499 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import shutil
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+ATIME_OPTIONS: Final[frozenset[str]] = frozenset(("atime", "noatime", "relatime", "strictatime"))
+
+CONFDIR: Final[Path] = Path("/etc/postgresql")
+
+FSTAB: Final[Path] = Path("/etc/fstab")
+
+
+@final
+class PostgreSQLCluster:
+    __slots__ = (
+        "_after",
+        "_before",
+        "_datadir",
+        "_fsgroup",
+        "_fsowner",
+        "_fstab",
+        "_module",
+        "_offline",
+        "_placements",
+        "_ports",
+        "_seconds",
+    )
+
+    def __init__(self, module: AnsibleModule, datadir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._datadir = datadir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._before: dict[str, str] = {}
+        self._after: dict[str, str] = {}
+        self._fstab: list[str] = []
+        self._offline: set[str] = set()
+        self._placements: dict[str, dict[str, Path]] = {}
+        self._ports: dict[str, int] = {}
+        self._seconds: dict[str, float] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "postgresql clusters",
+            "after": self._format(self._after),
+            "after_header": "postgresql clusters",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode:
+            return
+
+        jobs: int = self._module.params["jobs"]
+        with ThreadPoolExecutor(jobs) as executor:
+            futures = {
+                key: executor.submit(self._drop, entry)
+                for entry in self._module.params["delete"] or []
+                if (key := f"{entry['version']}/{entry['name']}") in self._before
+            }
+        self._collect(futures, "Failed to drop PostgreSQL clusters")
+
+        self._flush_mounts()
+
+        with ThreadPoolExecutor(jobs) as executor:
+            futures = {
+                f"{entry['version']}/{entry['name']}": executor.submit(self._create, entry)
+                for entry in self._module.params["create"] or []
+            }
+        self._collect(futures, "Failed to create PostgreSQL clusters")
+
+    def populate(self) -> None:
+        self._after.update(self._before)
+        for entry in self._module.params["delete"] or []:
+            key = f"{entry['version']}/{entry['name']}"
+            self._after.pop(key, None)
+            for k in [k for k in self._after if k.startswith(f"tablespace {key} ")]:
+                del self._after[k]
+
+        mountpoints: set[Path] = set()
+        for entry in self._module.params["create"] or []:
+            key = f"{entry['version']}/{entry['name']}"
+            placement = self._placements[key]
+            self._validate(key, entry, placement)
+            wanted = _describe(placement["data"], placement.get("wal"))
+            if key in self._before and self._before[key] != wanted:
+                self._module.warn(f"cluster {key} already exists as {self._before[key]}, placement is not moved")
+            self._after.setdefault(key, wanted)
+            # mount options only need fstab and /proc, a stopped cluster is checked like any other
+            mountpoints.update(_roots(entry).values())
+            if key in self._offline:
+                self._module.warn(f"cluster {key} is not running, its tablespaces are left unchecked")
+                continue
+            for role, path in placement.items():
+                name = role.partition(":")[2]
+                if name:
+                    self._after[f"tablespace {key} {name}"] = str(path)
+
+        # pg_createcluster picks the next free port itself, which races when clusters are created concurrently
+        used = set(self._ports.values())
+        port = 5432
+        for entry in self._module.params["create"] or []:
+            key = f"{entry['version']}/{entry['name']}"
+            if key in self._ports:
+                continue
+            while port in used:
+                port += 1
+            self._ports[key] = port
+            used.add(port)
+
+        if self._module.params["noatime"]:
+            for mountpoint in sorted(mountpoints):
+                self._after[f"mount {mountpoint}"] = _noatime(self._before[f"mount {mountpoint}"])
+
+    def prepare(self) -> None:
+        mounts = {
+            fields[1]: fields[3]
+            for fields in (line.split() for line in Path("/proc/self/mounts").read_text(encoding="utf-8").splitlines())
+        }
+        if FSTAB.exists():
+            self._fstab = FSTAB.read_text(encoding="utf-8").splitlines(keepends=True)
+
+        # a cluster exists once pg_createcluster has written its configuration, wherever its data lives
+        datadirs: dict[str, Path] = {}
+        for conf in sorted(CONFDIR.glob("*/*/postgresql.conf")):
+            key = f"{conf.parent.parent.name}/{conf.parent.name}"
+            datadirs[key] = Path(_setting(conf, "data_directory") or self._datadir / key)
+            self._ports[key] = int(_setting(conf, "port") or 5432)
+            if not (datadirs[key] / "PG_VERSION").exists():
+                self._module.warn(f"cluster {key} is configured but has no data directory at {datadirs[key]}")
+
+        for entry in self._module.params["delete"] or []:
+            key = f"{entry['version']}/{entry['name']}"
+            if key in datadirs:
+                self._before[key] = _describe(datadirs[key], _waldir(datadirs[key]))
+
+        for entry in self._module.params["create"] or []:
+            key = f"{entry['version']}/{entry['name']}"
+            placement = self._placement(entry)
+            self._placements[key] = placement
+            if entry["port"]:
+                self._ports[key] = entry["port"]
+            if key in datadirs:
+                self._before[key] = _describe(datadirs[key], _waldir(datadirs[key]))
+                tablespaces = self._tablespaces(entry)
+                if tablespaces is None:
+                    self._offline.add(key)
+                for name, location in (tablespaces or {}).items():
+                    self._before[f"tablespace {key} {name}"] = location
+            for root in _roots(entry).values():
+                self._before[f"mount {root}"] = mounts.get(str(root), "")
+
+    def results(self) -> list[dict]:
+        deleted = {f"{entry['version']}/{entry['name']}" for entry in self._module.params["delete"] or []}
+        return [
+            {
+                "cluster": key,
+                "state": "absent" if key in deleted else "present",
+                "changed": self._before.get(key) != self._after.get(key),
+                "port": None if key in deleted else self._ports.get(key),
+                "seconds": round(self._seconds.get(key, 0.0), 3),
+            }
+            for key in sorted({*self._placements, *deleted})
+        ]
+
+    def _collect(self, futures: dict[str, Future[None]], msg: str) -> None:
+        failures: dict[str, str] = {}
+        for key, future in futures.items():
+            try:
+                future.result()
+            # a missing owner or a read-only mount surfaces from the workers as OSError or LookupError
+            except (LookupError, OSError, RuntimeError) as e:
+                failures[key] = str(e)
+        if failures:
+            self._module.fail_json(msg=msg, failures=failures, clusters=self.results())
+
+    def _create(self, entry: dict) -> None:
+        start = time.monotonic()
+        key = f"{entry['version']}/{entry['name']}"
+        placement = self._placements[key]
+        if key not in self._before:
+            for role, path in placement.items():
+                if role != "data":
+                    self._mkdir(path.parent, entry)
+            argv = [
+                "pg_createcluster",
+                "--user",
+                entry["user"],
+                "--group",
+                entry["group"],
+                "--locale",
+                entry["locale"],
+                "--datadir",
+                str(placement["data"]),
+                "--port",
+                str(self._ports[key]),
+            ]
+            if entry["encoding"]:
+                argv.extend(("--encoding", entry["encoding"]))
+            argv.extend((entry["version"], entry["name"], "--start", "--", *_initdb_args(entry)))
+            if "wal" in placement:
+                argv.append(f"--waldir={placement['wal']}")
+            self._run(argv)
+
+        for role, path in placement.items():
+            name = role.partition(":")[2]
+            if name and key not in self._offline and self._before.get(f"tablespace {key} {name}") != str(path):
+                self._mkdir(path, entry)
+                self._psql(
+                    entry,
+                    'CREATE TABLESPACE :"name" OWNER :"owner" LOCATION :\'location\';',
+                    name=name,
+                    owner=entry["user"],
+                    location=str(path),
+                )
+        self._seconds[key] = time.monotonic() - start
+
+    def _drop(self, entry: dict) -> None:
+        start = time.monotonic()
+        self._run(["pg_dropcluster", "--stop", entry["version"], entry["name"]])
+        self._seconds[f"{entry['version']}/{entry['name']}"] = time.monotonic() - start
+
+    def _flush_mounts(self) -> None:
+        remounts = [
+            key.partition(" ")[2]
+            for key, options in self._after.items()
+            if key.startswith("mount ") and options != self._before[key]
+        ]
+        if not remounts:
+            return
+
+        mount = self._module.get_bin_path("mount", required=True)
+        for i, line in enumerate(self._fstab):
+            fields = line.split()
+            if len(fields) >= 4 and not fields[0].startswith("#") and fields[1] in remounts:
+                if _noatime(fields[3]) != fields[3]:
+                    fields[3] = _noatime(fields[3])
+                    self._fstab[i] = "\t".join(fields) + "\n"
+        FSTAB.write_text("".join(self._fstab), encoding="utf-8")
+        FSTAB.chmod(0o644)
+        shutil.chown(FSTAB, self._fsowner, self._fsgroup)
+        for mountpoint in remounts:
+            self._module.run_command([mount, "-o", "remount,noatime", mountpoint], check_rc=True)
+
+    def _format(self, state: dict[str, str]) -> str:
+        return "".join(f"{key}: {value}\n" for key, value in sorted(state.items()))
+
+    def _mkdir(self, path: Path, entry: dict) -> None:
+        path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        shutil.chown(path, entry["user"], entry["group"])
+
+    def _placement(self, entry: dict) -> dict[str, Path]:
+        version: str = entry["version"]
+        name: str = entry["name"]
+        roots = _roots(entry)
+        placement = {role: root / version / name for role, root in roots.items()}
+        if entry["datadir"]:
+            placement["data"] = Path(entry["datadir"])
+        elif "data" not in placement:
+            placement["data"] = self._datadir / version / name
+        if "wal" in placement:
+            placement["wal"] /= "pg_wal"
+        for role in placement:
+            if role.startswith("tablespace:"):
+                placement[role] /= role.partition(":")[2]
+        return placement
+
+    def _psql(self, entry: dict, sql: str, **variables: str) -> str:
+        argv = ["runuser", "-u", entry["user"], "--", "psql", "--cluster", f"{entry['version']}/{entry['name']}"]
+        # the script goes through stdin because psql only interpolates variables there
+        script = "".join(f"\\set {name} '{_quote(value)}'\n" for name, value in variables.items()) + sql
+        return self._run([*argv, "-X", "-q", "-A", "-t", "-v", "ON_ERROR_STOP=1", "-d", "postgres"], script)
+
+    def _run(self, argv: list[str], data: str | None = None) -> str:
+        binary = self._module.get_bin_path(argv[0])
+        if not binary:
+            raise RuntimeError(f"{argv[0]} not found")
+        rc, out, err = self._module.run_command([binary, *argv[1:]], data=data)
+        if rc:
+            raise RuntimeError(f"{' '.join(argv)} failed ({rc}): {err.strip()}")
+        return out
+
+    def _tablespaces(self, entry: dict) -> dict[str, str] | None:
+        pg_lsclusters = self._module.get_bin_path("pg_lsclusters", required=True)
+        rc, out, _ = self._module.run_command([pg_lsclusters, "--no-header", entry["version"], entry["name"]])
+        if rc or "online" not in out.split():
+            return None
+        try:
+            out = self._psql(
+                entry,
+                "SELECT spcname || '|' || pg_tablespace_location(oid) FROM pg_tablespace WHERE spcname !~ '^pg_';",
+            )
+        except (LookupError, OSError, RuntimeError) as e:
+            self._module.fail_json(msg=str(e))
+        return dict(line.split("|", 1) for line in out.splitlines() if line)
+
+    def _validate(self, key: str, entry: dict, placement: dict[str, Path]) -> None:
+        for role, root in _roots(entry).items():
+            if not os.path.ismount(root):
+                self._module.fail_json(msg=f"{role} placement of cluster {key} is not a mountpoint: {root}")
+
+        devices: dict[int, str] = {}
+        for role, path in placement.items():
+            mountpoint = _mountpoint(path)
+            dev = mountpoint.stat().st_dev
+            if dev in devices and not (role.startswith("tablespace:") and devices[dev].startswith("tablespace:")):
+                self._module.fail_json(
+                    msg=f"{role} and {devices[dev]} of cluster {key} share the device at {mountpoint}"
+                )
+            devices.setdefault(dev, role)
+
+
+def _describe(datadir: Path, waldir: Path | None) -> str:
+    return f"{datadir} (wal {waldir})" if waldir else str(datadir)
+
+
+def _initdb_args(entry: dict) -> list[str]:
+    args: list[str] = []
+    if entry["wal_segsize"]:
+        args.append(f"--wal-segsize={entry['wal_segsize']}")
+    if entry["data_checksums"]:
+        args.append("--data-checksums")
+    elif entry["data_checksums"] is False and int(entry["version"].partition(".")[0]) >= 18:
+        args.append("--no-data-checksums")
+    if entry["locale_provider"]:
+        args.append(f"--locale-provider={entry['locale_provider']}")
+    if entry["icu_locale"]:
+        args.append(f"--icu-locale={entry['icu_locale']}")
+    return args
+
+
+def _mountpoint(path: Path) -> Path:
+    path = Path(os.path.abspath(path))
+    while not os.path.ismount(path):
+        path = path.parent
+    return path
+
+
+def _noatime(options: str) -> str:
+    # only the atime option is touched, the kernel and other tools order the remaining options as they like
+    values = options.split(",")
+    if "noatime" in values:
+        return options
+    atime = [i for i, value in enumerate(values) if value in ATIME_OPTIONS]
+    if not atime:
+        return ",".join([*values, "noatime"])
+    values[atime[0]] = "noatime"
+    return ",".join(value for i, value in enumerate(values) if i not in atime[1:])
+
+
+def _quote(value: str) -> str:
+    # psql meta-command arguments treat backslashes as escapes and double single quotes
+    return value.replace("\\", "\\\\").replace("'", "''")
+
+
+def _roots(entry: dict) -> dict[str, Path]:
+    roles: dict = entry["placement"] or {}
+    roots = {role: Path(roles[role]) for role in ("data", "wal") if roles.get(role)}
+    roots.update((f"tablespace:{t['name']}", Path(t["location"])) for t in roles.get("tablespaces") or [])
+    return roots
+
+
+def _setting(conf: Path, key: str) -> str | None:
+    pattern = rf"^\s*{re.escape(key)}\s*=\s*(?:'([^']*)'|([^\s#]+))"
+    match = re.search(pattern, conf.read_text(encoding="utf-8"), re.MULTILINE)
+    if not match:
+        return None
+    return match.group(1) if match.group(1) is not None else match.group(2)
+
+
+def _waldir(datadir: Path) -> Path | None:
+    wal = datadir / "pg_wal"
+    return wal.resolve() if wal.is_symlink() else None
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "create": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "version": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "name": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "user": {
+                        "type": "str",
+                        "default": "postgres",
+                    },
+                    "group": {
+                        "type": "str",
+                        "default": "postgres",
+                    },
+                    "locale": {
+                        "type": "str",
+                        "default": "C.UTF-8",
+                    },
+                    "datadir": {
+                        "type": "path",
+                    },
+                    "port": {
+                        "type": "int",
+                    },
+                    "encoding": {
+                        "type": "str",
+                    },
+                    "wal_segsize": {
+                        "type": "int",
+                    },
+                    "data_checksums": {
+                        "type": "bool",
+                    },
+                    "locale_provider": {
+                        "type": "str",
+                        "choices": ["builtin", "icu", "libc"],
+                    },
+                    "icu_locale": {
+                        "type": "str",
+                    },
+                    "placement": {
+                        "type": "dict",
+                        "options": {
+                            "data": {
+                                "type": "path",
+                            },
+                            "wal": {
+                                "type": "path",
+                            },
+                            "tablespaces": {
+                                "type": "list",
+                                "elements": "dict",
+                                "default": [],
+                                "options": {
+                                    "name": {
+                                        "type": "str",
+                                        "required": True,
+                                    },
+                                    "location": {
+                                        "type": "path",
+                                        "required": True,
+                                    },
+                                },
+                            },
+                        },
+                    },
+                },
+            },
+            "delete": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "version": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "name": {
+                        "type": "str",
+                        "required": True,
+                    },
+                },
+            },
+            "jobs": {
+                "type": "int",
+                "default": 4,
+            },
+            "noatime": {
+                "type": "bool",
+                "default": True,
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    cluster = PostgreSQLCluster(module, Path("/var/lib/postgresql"), "root", "root")
+    cluster.prepare()
+    cluster.populate()
+    cluster.flush()
+
+    changed, diff = cluster.diff()
+    module.exit_json(changed=changed, diff=diff, clusters=cluster.results())
+
+
+if __name__ == "__main__":
+    _run_module()
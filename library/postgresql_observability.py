@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import re
+import shutil
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+# extensions backed by a preloaded library, in the order they must be loaded
+PRESETS: Final[dict[str, str | None]] = {
+    "pg_stat_statements": "pg_stat_statements",
+    "pg_stat_kcache": "pg_stat_kcache",
+    "auto_explain": None,
+}
+
+
+@final
+class PostgreSQLObservability:
+    __slots__ = ("_after", "_before", "_clusters", "_confdir", "_fsgroup", "_fsowner", "_module")
+
+    def __init__(self, module: AnsibleModule, confdir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._confdir = confdir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._before: dict[str, str] = {}
+        self._after: dict[str, str] = {}
+        self._clusters: dict[str, dict] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "postgresql observability",
+            "after": self._format(self._after),
+            "after_header": "postgresql observability",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode:
+            return
+
+        pg_ctlcluster = self._module.get_bin_path("pg_ctlcluster", required=True)
+        for key, cluster in self._clusters.items():
+            path: Path = cluster["path"]
+            content = self._after[str(path)]
+            if content != self._before[str(path)]:
+                path.write_text(content, encoding="utf-8")
+                path.chmod(0o644)
+                shutil.chown(path, self._fsowner, self._fsgroup)
+
+            if cluster["running"] is None:
+                continue
+            # a preload change is the only thing here that needs more than a reload
+            if self._before[f"preload {key}"] != self._after[f"preload {key}"]:
+                self._module.run_command([pg_ctlcluster, *key.split("/"), "restart"], check_rc=True)
+            elif content != self._before[str(path)]:
+                self._module.run_command([pg_ctlcluster, *key.split("/"), "reload"], check_rc=True)
+            for database in cluster["entry"]["databases"]:
+                for extension in cluster["extensions"]:
+                    if f"extension {key} {database} {extension}" not in self._before:
+                        self._psql(cluster["entry"], database, f'CREATE EXTENSION IF NOT EXISTS "{extension}"')
+
+    def populate(self) -> None:
+        presets: list[str] = [name for name in PRESETS if name in self._module.params["presets"]]
+        for key, cluster in self._clusters.items():
+            entry: dict = cluster["entry"]
+            libraries = list(dict.fromkeys([*cluster["base"], *presets, *entry["libraries"]]))
+            cluster["extensions"] = list(
+                dict.fromkeys([*(PRESETS[name] for name in presets if PRESETS[name]), *entry["extensions"]])
+            )
+
+            settings = {"shared_preload_libraries": "'" + ",".join(libraries) + "'"}
+            if self._module.params["track_io_timing"]:
+                settings["track_io_timing"] = "on"
+            if "pg_stat_statements" in presets:
+                settings["pg_stat_statements.max"] = str(self._module.params["pg_stat_statements_max"])
+                settings["pg_stat_statements.track"] = self._module.params["pg_stat_statements_track"]
+            if "auto_explain" in presets:
+                for option, value in self._module.params["auto_explain"].items():
+                    settings[f"auto_explain.{option}"] = _value(value)
+            self._after[str(cluster["path"])] = "".join(f"{k} = {v}\n" for k, v in settings.items())
+
+            if cluster["running"] is None:
+                self._module.warn(f"cluster {key} is not running, extensions are created on the next run")
+                continue
+            self._after[f"preload {key}"] = ",".join(libraries)
+            for database in entry["databases"]:
+                for extension in cluster["extensions"]:
+                    self._after[f"extension {key} {database} {extension}"] = "installed"
+
+    def prepare(self) -> None:
+        pg_lsclusters = self._module.get_bin_path("pg_lsclusters", required=True)
+        for entry in self._module.params["clusters"] or []:
+            key = f"{entry['version']}/{entry['name']}"
+            conf = self._confdir / entry["version"] / entry["name"] / "postgresql.conf"
+            if not conf.exists():
+                self._module.warn(f"cluster {key} does not exist and was skipped")
+                continue
+
+            path = conf.parent / "conf.d" / self._module.params["filename"]
+            self._before[str(path)] = path.read_text(encoding="utf-8") if path.exists() else ""
+            self._after[str(path)] = ""
+
+            _, out, _ = self._module.run_command([pg_lsclusters, "--no-header", entry["version"], entry["name"]])
+            running: list[str] | None = None
+            if "online" in out.split():
+                running = _libraries(self._psql(entry, "postgres", "SHOW shared_preload_libraries"))
+                self._before[f"preload {key}"] = ",".join(running)
+                managed = {*filter(None, PRESETS.values()), *entry["extensions"]}
+                for database in entry["databases"]:
+                    for extension in self._psql(entry, database, "SELECT extname FROM pg_extension").split():
+                        if extension in managed:
+                            self._before[f"extension {key} {database} {extension}"] = "installed"
+
+            # libraries loaded by anything other than our own file are kept, the ones only we added are not sticky
+            owned = _libraries(_setting(path, "shared_preload_libraries") or "") if path.exists() else []
+            base = self._base(conf, path)
+            if running is not None:
+                base = list(dict.fromkeys([*base, *(library for library in running if library not in owned)]))
+
+            self._clusters[key] = {
+                "base": base,
+                "entry": entry,
+                "path": path,
+                "running": running,
+            }
+
+    def _base(self, conf: Path, path: Path) -> list[str]:
+        value = _setting(conf, "shared_preload_libraries") or ""
+        for other in sorted((conf.parent / "conf.d").glob("*.conf")):
+            setting = _setting(other, "shared_preload_libraries") if other != path else None
+            if setting is None:
+                continue
+            if other.name > path.name:
+                self._module.warn(f"{other} sets shared_preload_libraries after {path.name} and overrides it")
+            value = setting
+        return _libraries(value)
+
+    def _format(self, state: dict[str, str]) -> str:
+        files = "".join(f"[{key}]\n{value}" for key, value in sorted(state.items()) if key.startswith("/") and value)
+        return files + "".join(f"{key}: {value}\n" for key, value in sorted(state.items()) if not key.startswith("/"))
+
+    def _psql(self, entry: dict, database: str, sql: str) -> str:
+        runuser = self._module.get_bin_path("runuser", required=True)
+        argv = [runuser, "-u", entry["user"], "--", "psql", "--cluster", f"{entry['version']}/{entry['name']}"]
+        _, out, _ = self._module.run_command(
+            [*argv, "-X", "-q", "-A", "-t", "-v", "ON_ERROR_STOP=1", "-d", database, "-c", sql], check_rc=True
+        )
+        return out.strip()
+
+
+def _libraries(value: str) -> list[str]:
+    return [library.strip().strip('"') for library in value.split(",") if library.strip()]
+
+
+def _setting(conf: Path, key: str) -> str | None:
+    pattern = rf"^\s*{re.escape(key)}\s*=\s*(?:'([^']*)'|([^\s#]+))"
+    match = re.search(pattern, conf.read_text(encoding="utf-8"), re.MULTILINE)
+    if not match:
+        return None
+    return match.group(1) if match.group(1) is not None else match.group(2)
+
+
+def _value(value: object) -> str:
+    if isinstance(value, bool):
+        return "on" if value else "off"
+    if isinstance(value, str):
+        return f"'{value}'"
+    return str(value)
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "clusters": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "version": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "name": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "user": {
+                        "type": "str",
+                        "default": "postgres",
+                    },
+                    "databases": {
+                        "type": "list",
+                        "elements": "str",
+                        "default": ["postgres"],
+                    },
+                    "libraries": {
+                        "type": "list",
+                        "elements": "str",
+                        "default": [],
+                    },
+                    "extensions": {
+                        "type": "list",
+                        "elements": "str",
+                        "default": [],
+                    },
+                },
+            },
+            "auto_explain": {
+                "type": "dict",
+                "apply_defaults": True,
+                "options": {
+                    "log_min_duration": {
+                        "type": "str",
+                        "default": "500ms",
+                    },
+                    "log_analyze": {
+                        "type": "bool",
+                        "default": True,
+                    },
+                    "log_buffers": {
+                        "type": "bool",
+                        "default": True,
+                    },
+                    "log_timing": {
+                        "type": "bool",
+                        "default": False,
+                    },
+                    "log_nested_statements": {
+                        "type": "bool",
+                        "default": False,
+                    },
+                    "sample_rate": {
+                        "type": "float",
+                        "default": 1.0,
+                    },
+                },
+            },
+            "filename": {
+                "type": "str",
+                "default": "60-observability.conf",
+            },
+            "presets": {
+                "type": "list",
+                "elements": "str",
+                "choices": list(PRESETS),
+                "default": list(PRESETS),
+            },
+            "pg_stat_statements_max": {
+                "type": "int",
+                "default": 10000,
+            },
+            "pg_stat_statements_track": {
+                "type": "str",
+                "choices": ["top", "all", "none"],
+                "default": "top",
+            },
+            "track_io_timing": {
+                "type": "bool",
+                "default": True,
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    observability = PostgreSQLObservability(module, Path("/etc/postgresql"), "postgres", "postgres")
+    observability.prepare()
+    observability.populate()
+    observability.flush()
+
+    changed, diff = observability.diff()
+    module.exit_json(changed=changed, diff=diff)
+
+
+if __name__ == "__main__":
+    _run_module()
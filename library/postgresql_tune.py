@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+HUGEPAGES_CONF: Final[Path] = Path("/etc/sysctl.d/60-postgresql-hugepages.conf")
+
+RESTART_SETTINGS: Final[frozenset[str]] = frozenset(
+    (
+        "huge_pages",
+        "max_connections",
+        "max_worker_processes",
+        "shared_buffers",
+        "timescaledb.max_background_workers",
+        "wal_buffers",
+    )
+)
+
+# (min_wal_size, max_wal_size) in MB, following pgtune's workload presets
+WAL_SIZES: Final[dict[str, tuple[int, int]]] = {
+    "web": (1024, 4096),
+    "oltp": (2048, 8192),
+    "dw": (4096, 16384),
+    "mixed": (1024, 4096),
+}
+
+STORAGE_SETTINGS: Final[dict[str, tuple[str, int]]] = {
+    "hdd": ("4", 2),
+    "ssd": ("1.1", 200),
+    "nvme": ("1.1", 256),
+}
+
+
+@final
+class PostgreSQLTune:
+    __slots__ = ("_after", "_before", "_clusters", "_confdir", "_fsgroup", "_fsowner", "_module", "_running")
+
+    def __init__(self, module: AnsibleModule, confdir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._confdir = confdir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._before: dict[Path, str] = {}
+        self._after: dict[Path, str] = {}
+        self._clusters: dict[tuple[str, str], dict] = {}
+        self._running: set[tuple[str, str]] = set()
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after, {
+            "before": self._format(self._before),
+            "before_header": "postgresql tuning",
+            "after": self._format(self._after),
+            "after_header": "postgresql tuning",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode:
+            return
+
+        for path, content in self._after.items():
+            if content == self._before[path]:
+                continue
+            if not content:
+                path.unlink(missing_ok=True)
+                continue
+            owner, group = ("root", "root") if path == HUGEPAGES_CONF else (self._fsowner, self._fsgroup)
+            if not path.parent.exists():
+                path.parent.mkdir(mode=0o755)
+                shutil.chown(path.parent, owner, group)
+            path.write_text(content, encoding="utf-8")
+            path.chmod(0o644)
+            shutil.chown(path, owner, group)
+
+        if self._before[HUGEPAGES_CONF] != self._after[HUGEPAGES_CONF] and self._after[HUGEPAGES_CONF]:
+            nr_hugepages = Path("/proc/sys/vm/nr_hugepages")
+            wanted = _parse(self._after[HUGEPAGES_CONF])["vm.nr_hugepages"]
+            nr_hugepages.write_text(wanted, encoding="ascii")
+            allocated = nr_hugepages.read_text(encoding="ascii").strip()
+            if allocated != wanted:
+                self._module.warn(f"only {allocated} of {wanted} huge pages could be reserved until the next boot")
+
+        pg_ctlcluster = self._module.get_bin_path("pg_ctlcluster", required=True)
+        for (version, name), cluster in self._clusters.items():
+            path = cluster["path"]
+            if self._before[path] == self._after[path]:
+                continue
+            # a cluster tuned for the first time has never run with these settings, nothing is lost by restarting it
+            allowed = self._module.params["restart"] or not self._before[path]
+            if (version, name) not in self._running:
+                if not self._before[path]:
+                    self._module.run_command([pg_ctlcluster, version, name, "start"], check_rc=True)
+                continue
+            before, after = _parse(self._before[path]), _parse(self._after[path])
+            restart = any(before.get(key) != after.get(key) for key in RESTART_SETTINGS)
+            if restart and not allowed:
+                self._module.warn(f"cluster {version}/{name} needs a restart to apply the new settings")
+            action = "restart" if restart and allowed else "reload"
+            self._module.run_command([pg_ctlcluster, version, name, action], check_rc=True)
+
+    def populate(self) -> None:
+        if not self._clusters:
+            return
+
+        meminfo = _meminfo()
+        cores = os.cpu_count() or 1
+        huge_pages: str = self._module.params["huge_pages"]
+        reserved = 0
+        for (version, name), cluster in self._clusters.items():
+            overrides: dict = cluster["overrides"]
+            share: float = overrides.get("memory_share") or 1 / len(self._clusters)
+            ram = int(meminfo["MemTotal"] * share)
+            storage: str = overrides.get("storage") or self._storage(cluster["datadir"])
+            timescaledb = Path("/usr/share/postgresql", version, "extension", "timescaledb.control").exists()
+            settings = _settings(
+                ram,
+                cores,
+                storage,
+                overrides.get("workload") or "mixed",
+                overrides.get("max_connections") or 100,
+                self._module.params["timescaledb_background_workers"] if timescaledb else 0,
+            )
+            settings["huge_pages"] = huge_pages
+            self._after[cluster["path"]] = "".join(f"{key} = {value}\n" for key, value in settings.items())
+
+            # shared memory is shared_buffers plus wal_buffers and a small allowance for lock and proc tables
+            reserved += ram // 4 + 16384 + 10 * (overrides.get("max_connections") or 100)
+
+        if huge_pages != "off":
+            pages = math.ceil(reserved / meminfo["Hugepagesize"])
+            self._after[HUGEPAGES_CONF] = f"vm.nr_hugepages = {pages}\n"
+
+    def prepare(self) -> None:
+        # only the listed clusters are tuned, others on the host keep whatever their owners configured
+        for entry in self._module.params["clusters"] or []:
+            version, name = entry["version"], entry["name"]
+            conf = self._confdir / version / name / "postgresql.conf"
+            if not conf.exists():
+                self._module.warn(f"cluster {version}/{name} does not exist and was not tuned")
+                continue
+            path = conf.parent / "conf.d" / self._module.params["filename"]
+            self._clusters[version, name] = {
+                "datadir": _setting(conf, "data_directory") or f"/var/lib/postgresql/{version}/{name}",
+                "overrides": entry,
+                "path": path,
+            }
+            self._before[path] = path.read_text(encoding="utf-8") if path.exists() else ""
+            self._after[path] = ""
+
+        self._before[HUGEPAGES_CONF] = HUGEPAGES_CONF.read_text(encoding="utf-8") if HUGEPAGES_CONF.exists() else ""
+        self._after[HUGEPAGES_CONF] = ""
+
+        pg_lsclusters = self._module.get_bin_path("pg_lsclusters")
+        if pg_lsclusters:
+            _, out, _ = self._module.run_command([pg_lsclusters, "--no-header"], check_rc=True)
+            for line in out.splitlines():
+                fields = line.split()
+                # replicas report themselves as online,recovery
+                if len(fields) > 3 and fields[3].startswith("online"):
+                    self._running.add((fields[0], fields[1]))
+
+    def results(self) -> dict[str, dict[str, str]]:
+        return {f"{version}/{name}": _parse(self._after[c["path"]]) for (version, name), c in self._clusters.items()}
+
+    def _format(self, state: dict[Path, str]) -> str:
+        return "".join(f"[{path}]\n{content}" for path, content in state.items() if content)
+
+    def _storage(self, datadir: str) -> str:
+        path = Path(datadir)
+        while not path.exists():
+            path = path.parent
+        dev = path.stat().st_dev
+        sysfs = Path("/sys/dev/block", f"{os.major(dev)}:{os.minor(dev)}")
+        if not sysfs.exists():
+            self._module.warn(f"cannot find the block device backing {datadir}, assuming ssd")
+            return "ssd"
+
+        sysfs = sysfs.resolve()
+        if (sysfs / "partition").exists():
+            sysfs = sysfs.parent
+        names = [sysfs.name, *(slave.name for slave in (sysfs / "slaves").glob("*"))]
+        if any(name.startswith("nvme") for name in names):
+            return "nvme"
+        rotational = sysfs / "queue" / "rotational"
+        return "hdd" if rotational.exists() and rotational.read_text(encoding="ascii").strip() == "1" else "ssd"
+
+
+def _meminfo() -> dict[str, int]:
+    meminfo: dict[str, int] = {}
+    for line in Path("/proc/meminfo").read_text(encoding="ascii").splitlines():
+        key, _, value = line.partition(":")
+        meminfo[key] = int(value.split()[0])
+    return meminfo
+
+
+def _parse(content: str) -> dict[str, str]:
+    return {
+        key.strip(): value.strip() for key, sep, value in (line.partition("=") for line in content.splitlines()) if sep
+    }
+
+
+def _setting(conf: Path, key: str) -> str | None:
+    pattern = rf"^\s*{re.escape(key)}\s*=\s*(?:'([^']*)'|([^\s#]+))"
+    match = re.search(pattern, conf.read_text(encoding="utf-8"), re.MULTILINE)
+    if not match:
+        return None
+    return match.group(1) if match.group(1) is not None else match.group(2)
+
+
+def _settings(ram: int, cores: int, storage: str, workload: str, connections: int, bgw: int) -> dict[str, str]:
+    # ram is in kB, matching /proc/meminfo and PostgreSQL's own unit suffixes
+    shared_buffers = ram // 4
+    per_gather = min(math.ceil(cores / 2), 4)
+    work_mem = max((ram - shared_buffers) // (connections * 3) // per_gather, 64)
+    if workload == "dw":
+        work_mem //= 2
+    random_page_cost, effective_io_concurrency = STORAGE_SETTINGS[storage]
+    min_wal_size, max_wal_size = WAL_SIZES[workload]
+
+    settings = {
+        "max_connections": str(connections),
+        "shared_buffers": _size(shared_buffers),
+        "effective_cache_size": _size(ram * 3 // 4),
+        "maintenance_work_mem": _size(min(ram // (8 if workload == "dw" else 16), 2 * 1024 * 1024)),
+        "work_mem": _size(work_mem),
+        "wal_buffers": _size(min(max(shared_buffers * 3 // 100, 32), 16384)),
+        "min_wal_size": _size(min_wal_size * 1024),
+        "max_wal_size": _size(max_wal_size * 1024),
+        "checkpoint_completion_target": "0.9",
+        "default_statistics_target": "500" if workload == "dw" else "100",
+        "random_page_cost": random_page_cost,
+        "effective_io_concurrency": str(effective_io_concurrency),
+        "max_worker_processes": str(cores + (bgw + 3 if bgw else 0)),
+        "max_parallel_workers": str(cores),
+        "max_parallel_workers_per_gather": str(per_gather),
+        "max_parallel_maintenance_workers": str(per_gather),
+    }
+    if bgw:
+        # timescaledb schedules its jobs as background workers taken from max_worker_processes
+        settings["timescaledb.max_background_workers"] = str(bgw)
+    return settings
+
+
+def _size(kb: int) -> str:
+    if kb % (1024 * 1024) == 0:
+        return f"{kb // (1024 * 1024)}GB"
+    if kb >= 1024:
+        return f"{kb // 1024}MB"
+    return f"{kb}kB"
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "clusters": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "version": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "name": {
+                        "type": "str",
+                        "required": True,
+                    },
+                    "max_connections": {
+                        "type": "int",
+                    },
+                    "memory_share": {
+                        "type": "float",
+                    },
+                    "storage": {
+                        "type": "str",
+                        "choices": ["hdd", "ssd", "nvme"],
+                    },
+                    "workload": {
+                        "type": "str",
+                        "choices": ["web", "oltp", "dw", "mixed"],
+                    },
+                },
+            },
+            "filename": {
+                "type": "str",
+                "default": "50-tune.conf",
+            },
+            "huge_pages": {
+                "type": "str",
+                "choices": ["try", "on", "off"],
+                "default": "try",
+            },
+            "restart": {
+                "type": "bool",
+                "default": False,
+            },
+            "timescaledb_background_workers": {
+                "type": "int",
+                "default": 8,
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    tune = PostgreSQLTune(module, Path("/etc/postgresql"), "postgres", "postgres")
+    tune.prepare()
+    tune.populate()
+    tune.flush()
+
+    changed, diff = tune.diff()
+    module.exit_json(changed=changed, diff=diff, clusters=tune.results())
+
+
+if __name__ == "__main__":
+    _run_module()
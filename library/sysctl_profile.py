@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import shutil
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+PRESETS: Final[dict[str, dict[str, str]]] = {
+    "database": {
+        "vm.swappiness": "1",
+        "vm.dirty_background_bytes": "67108864",
+        "vm.dirty_bytes": "536870912",
+        "vm.dirty_expire_centisecs": "500",
+        "vm.dirty_writeback_centisecs": "250",
+        # PostgreSQL prefers strict accounting, but Redis shares these hosts and cannot fork for BGSAVE under it
+        "vm.overcommit_memory": "1",
+        "vm.zone_reclaim_mode": "0",
+        "net.core.somaxconn": "4096",
+        "net.core.rmem_max": "16777216",
+        "net.core.wmem_max": "16777216",
+        "net.ipv4.tcp_rmem": "4096 131072 16777216",
+        "net.ipv4.tcp_wmem": "4096 131072 16777216",
+        "net.ipv4.tcp_max_syn_backlog": "8192",
+        "net.ipv4.tcp_keepalive_time": "120",
+        "net.ipv4.tcp_slow_start_after_idle": "0",
+        "fs.file-max": "2097152",
+    },
+    "container_host": {
+        "vm.swappiness": "10",
+        "vm.dirty_background_ratio": "5",
+        "vm.dirty_ratio": "15",
+        "vm.overcommit_memory": "1",
+        "vm.max_map_count": "262144",
+        "net.core.somaxconn": "65535",
+        "net.core.netdev_max_backlog": "16384",
+        "net.core.rmem_max": "16777216",
+        "net.core.wmem_max": "16777216",
+        "net.ipv4.tcp_rmem": "4096 87380 16777216",
+        "net.ipv4.tcp_wmem": "4096 65536 16777216",
+        "net.ipv4.tcp_max_syn_backlog": "16384",
+        "net.ipv4.ip_local_port_range": "10240 65535",
+        "net.ipv4.ip_forward": "1",
+        "fs.file-max": "2097152",
+        "fs.inotify.max_user_instances": "8192",
+        "fs.inotify.max_user_watches": "524288",
+    },
+    "workstation": {
+        "vm.swappiness": "10",
+        "vm.dirty_background_ratio": "5",
+        "vm.dirty_ratio": "10",
+        "vm.overcommit_memory": "0",
+        "net.core.somaxconn": "4096",
+        "net.ipv4.tcp_rmem": "4096 131072 6291456",
+        "net.ipv4.tcp_wmem": "4096 16384 4194304",
+        "fs.file-max": "1048576",
+        "fs.inotify.max_user_watches": "524288",
+    },
+}
+
+# limits that are only ever raised, recent kernels and systemd already default fs.file-max to LONG_MAX
+RAISE_ONLY: Final[frozenset[str]] = frozenset(("fs.file-max",))
+
+# each pair is mutually exclusive in the kernel, writing one resets the other to 0
+EXCLUSIVE: Final[tuple[tuple[str, str], ...]] = (
+    ("vm.dirty_background_bytes", "vm.dirty_background_ratio"),
+    ("vm.dirty_bytes", "vm.dirty_ratio"),
+)
+
+
+@final
+class SysctlProfile:
+    __slots__ = ("_after", "_before", "_confdir", "_fsgroup", "_fsowner", "_live_after", "_live_before", "_module")
+
+    def __init__(self, module: AnsibleModule, confdir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._confdir = confdir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._before: dict[Path, str] = {}
+        self._after: dict[Path, str] = {}
+        self._live_before: dict[str, str] = {}
+        self._live_after: dict[str, str] = {}
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after or self._live_before != self._live_after, {
+            "before": self._format(self._before, self._live_before),
+            "before_header": "sysctl",
+            "after": self._format(self._after, self._live_after),
+            "after_header": "sysctl",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode:
+            return
+
+        for path, content in self._after.items():
+            if content == self._before[path]:
+                continue
+            if content:
+                path.write_text(content, encoding="utf-8")
+                path.chmod(0o644)
+                shutil.chown(path, self._fsowner, self._fsgroup)
+            else:
+                path.unlink(missing_ok=True)
+
+        # only keys whose running value differs were recorded, so untouched ones are never rewritten
+        for key, value in self._live_after.items():
+            try:
+                _proc(key).write_text(f"{value}\n", encoding="ascii")
+            except OSError as e:
+                self._module.fail_json(msg=f"kernel rejected {key} = {value}: {e}")
+
+    def populate(self) -> None:
+        settings: dict[str, str] = {}
+        for profile in self._module.params["profiles"]:
+            settings.update(PRESETS[profile])
+        overrides = {key: _value(value) for key, value in self._module.params["settings"].items()}
+        for pair in EXCLUSIVE:
+            for key, other in (pair, pair[::-1]):
+                if key in overrides and other not in overrides:
+                    settings.pop(other, None)
+            if all(key in settings for key in pair) and not any(key in overrides for key in pair):
+                # presets from different profiles disagree, the absolute limit is the safer one
+                del settings[pair[1]]
+        settings.update(overrides)
+        for key in RAISE_ONLY & settings.keys():
+            if _proc(key).exists() and int(_proc(key).read_text(encoding="ascii")) > int(settings[key]):
+                del settings[key]
+
+        path = self._confdir / self._module.params["filename"]
+        if settings:
+            self._after[path] = "".join(f"{key} = {value}\n" for key, value in sorted(settings.items()))
+
+        for key, value in sorted(settings.items()):
+            if not _proc(key).exists():
+                self._module.warn(f"{key} is not available on this kernel and only takes effect once it is")
+                continue
+            current = _normalise(_proc(key).read_text(encoding="ascii"))
+            if current != _normalise(value):
+                self._live_before[key] = current
+                self._live_after[key] = _normalise(value)
+
+    def prepare(self) -> None:
+        path = self._confdir / self._module.params["filename"]
+        self._before[path] = path.read_text(encoding="utf-8") if path.exists() else ""
+        self._after[path] = ""
+
+    def _format(self, state: dict[Path, str], live: dict[str, str]) -> str:
+        files = "".join(f"[{path}]\n{content}" for path, content in state.items() if content)
+        return files + "".join(f"[live] {key} = {value}\n" for key, value in live.items())
+
+
+def _normalise(value: str) -> str:
+    return " ".join(value.split())
+
+
+def _proc(key: str) -> Path:
+    return Path("/proc/sys", *key.split("."))
+
+
+def _value(value: object) -> str:
+    # YAML booleans would otherwise reach /proc/sys as True/False, which the kernel rejects
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "profiles": {
+                "type": "list",
+                "elements": "str",
+                "choices": list(PRESETS),
+                "default": [],
+            },
+            "settings": {
+                "type": "dict",
+                "default": {},
+            },
+            "filename": {
+                "type": "str",
+                "default": "90-profile.conf",
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    profile = SysctlProfile(module, Path("/etc/sysctl.d"), "root", "root")
+    profile.prepare()
+    profile.populate()
+    profile.flush()
+
+    changed, diff = profile.diff()
+    module.exit_json(changed=changed, diff=diff)
+
+
+if __name__ == "__main__":
+    _run_module()
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import ipaddress
+import re
+import shutil
+from pathlib import Path
+from typing import Final, final
+
+from ansible.module_utils.basic import AnsibleModule
+
+DEFAULTS: Final[Path] = Path("/etc/default/ufw")
+
+POLICIES: Final[dict[str, str]] = {
+    "allow": "ACCEPT",
+    "deny": "DROP",
+    "reject": "REJECT",
+}
+
+TARGETS: Final[dict[str, str]] = {
+    "allow": "ACCEPT",
+    "deny": "DROP",
+    "reject": "REJECT",
+    "limit": "ufw-user-limit-accept",
+}
+
+SECTION: Final[re.Pattern[str]] = re.compile(r"(### RULES ###\n)(.*?)(### END RULES ###\n)", re.DOTALL)
+
+
+@final
+class UFWRules:
+    __slots__ = ("_after", "_before", "_confdir", "_enabled", "_fsgroup", "_fsowner", "_module")
+
+    def __init__(self, module: AnsibleModule, confdir: Path, fsowner: str, fsgroup: str) -> None:
+        self._module = module
+        self._confdir = confdir
+        self._fsowner = fsowner
+        self._fsgroup = fsgroup
+        self._before: dict[Path, str] = {}
+        self._after: dict[Path, str] = {}
+        self._enabled = False
+
+    def diff(self) -> tuple[bool, dict[str, str]]:
+        return self._before != self._after or not self._enabled, {
+            "before": self._format(self._before, self._enabled),
+            "before_header": "ufw",
+            "after": self._format(self._after, True),
+            "after_header": "ufw",
+        }
+
+    def flush(self) -> None:
+        if self._module.check_mode or (self._before == self._after and self._enabled):
+            return
+
+        for path, content in self._after.items():
+            if content == self._before[path]:
+                continue
+            path.write_text(content, encoding="utf-8")
+            path.chmod(0o640 if path.parent == self._confdir else 0o644)
+            shutil.chown(path, self._fsowner, self._fsgroup)
+
+        # one reload swaps the whole ruleset in through iptables-restore, enable also loads it on first run
+        ufw = self._module.get_bin_path("ufw", required=True)
+        self._module.run_command([ufw, "--force", "enable"] if not self._enabled else [ufw, "reload"], check_rc=True)
+
+    def populate(self) -> None:
+        rules: list[dict] = [*self._module.params["rules"]]
+        for service in self._module.params["services"]:
+            port, _, proto = str(service).partition("/")
+            rules.append({"rule": "allow", "direction": "in", "port": port, "proto": proto or "any"})
+
+        for path, version in ((self._confdir / "user.rules", 4), (self._confdir / "user6.rules", 6)):
+            section = "".join(_render(rule, version) for rule in rules)
+            self._after[path] = SECTION.sub(lambda m, s=section: m.group(1) + s + m.group(3), self._before[path])
+
+        content = self._before[DEFAULTS]
+        for key, value in (
+            ("DEFAULT_INPUT_POLICY", POLICIES[self._module.params["incoming"]]),
+            ("DEFAULT_OUTPUT_POLICY", POLICIES[self._module.params["outgoing"]]),
+        ):
+            content = re.sub(rf"^{key}=.*$", f'{key}="{value}"', content, flags=re.MULTILINE)
+        self._after[DEFAULTS] = content
+
+    def prepare(self) -> None:
+        for path in (self._confdir / "user.rules", self._confdir / "user6.rules", DEFAULTS):
+            if not path.exists():
+                self._module.fail_json(msg=f"{path} does not exist, is ufw installed?")
+            self._before[path] = path.read_text(encoding="utf-8")
+            if path != DEFAULTS and not SECTION.search(self._before[path]):
+                self._module.fail_json(msg=f"{path} has no rules section")
+
+        conf = self._confdir / "ufw.conf"
+        self._enabled = conf.exists() and bool(re.search(r"^ENABLED=yes$", conf.read_text("utf-8"), re.MULTILINE))
+
+    def _format(self, state: dict[Path, str], enabled: bool) -> str:
+        lines: list[str] = []
+        for path, content in state.items():
+            if path == DEFAULTS:
+                lines.extend(f"{path}: {line}" for line in content.splitlines() if line.startswith("DEFAULT_"))
+                continue
+            section = SECTION.search(content)
+            rules = section.group(2) if section else ""
+            lines.extend(f"{path.name}: {line[14:]}" for line in rules.splitlines() if line.startswith("### tuple ###"))
+        lines.append(f"enabled: {'yes' if enabled else 'no'}")
+        return "".join(f"{line}\n" for line in lines)
+
+
+def _family(address: str) -> int | None:
+    if address == "any":
+        return None
+    return ipaddress.ip_network(address, strict=False).version
+
+
+def _render(rule: dict, version: int) -> str:
+    source, destination = rule.get("from_ip") or "any", rule.get("to_ip") or "any"
+    if {_family(source), _family(destination)} - {None, version}:
+        return ""
+
+    anywhere = "0.0.0.0/0" if version == 4 else "::/0"
+    prefix = "ufw-user" if version == 4 else "ufw6-user"
+    direction: str = rule.get("direction") or "in"
+    chain = f"{prefix}-{'input' if direction == 'in' else 'output'}"
+    port = str(rule.get("port") or "any")
+    proto: str = rule.get("proto") or "any"
+    interface = rule.get("interface")
+    action: str = rule["rule"]
+
+    tuple_direction = f"{direction}_{interface}" if interface else direction
+    src = anywhere if source == "any" else source
+    dst = anywhere if destination == "any" else destination
+    lines = [f"### tuple ### {action} {proto} {port} {dst} any {src} {tuple_direction}\n"]
+
+    for protocol in ("tcp", "udp") if port != "any" and proto == "any" else (proto,):
+        match = [f"-A {chain}"]
+        if interface:
+            match.append(f"{'-i' if direction == 'in' else '-o'} {interface}")
+        if protocol != "any":
+            match.append(f"-p {protocol}")
+        if destination != "any":
+            match.append(f"-d {destination}")
+        if port != "any":
+            match.append(f"-m multiport --dports {port}" if re.search(r"[:,]", port) else f"--dport {port}")
+        if source != "any":
+            match.append(f"-s {source}")
+        head = " ".join(match)
+        if action == "limit":
+            lines.append(f"{head} -m conntrack --ctstate NEW -m recent --set\n")
+            lines.append(
+                f"{head} -m conntrack --ctstate NEW -m recent --update --seconds 30 --hitcount 6 -j {prefix}-limit\n"
+            )
+            lines.append(f"{head} -j {prefix}-limit-accept\n")
+        elif action == "reject" and protocol == "tcp":
+            lines.append(f"{head} -j REJECT --reject-with tcp-reset\n")
+        else:
+            lines.append(f"{head} -j {TARGETS[action]}\n")
+    return "".join(lines) + "\n"
+
+
+def _run_module() -> None:
+    module = AnsibleModule(
+        argument_spec={
+            "incoming": {
+                "type": "str",
+                "choices": list(POLICIES),
+                "default": "deny",
+            },
+            "outgoing": {
+                "type": "str",
+                "choices": list(POLICIES),
+                "default": "allow",
+            },
+            "rules": {
+                "type": "list",
+                "elements": "dict",
+                "default": [],
+                "options": {
+                    "rule": {
+                        "type": "str",
+                        "choices": list(TARGETS),
+                        "required": True,
+                    },
+                    "direction": {
+                        "type": "str",
+                        "choices": ["in", "out"],
+                        "default": "in",
+                    },
+                    "interface": {
+                        "type": "str",
+                    },
+                    "from_ip": {
+                        "type": "str",
+                        "default": "any",
+                    },
+                    "to_ip": {
+                        "type": "str",
+                        "default": "any",
+                    },
+                    "port": {
+                        "type": "str",
+                    },
+                    "proto": {
+                        "type": "str",
+                        "choices": ["any", "tcp", "udp"],
+                        "default": "any",
+                    },
+                },
+            },
+            "services": {
+                "type": "list",
+                "elements": "str",
+                "default": [],
+            },
+        },
+        supports_check_mode=True,
+    )
+
+    rules = UFWRules(module, Path("/etc/ufw"), "root", "root")
+    rules.prepare()
+    rules.populate()
+    rules.flush()
+
+    changed, diff = rules.diff()
+    module.exit_json(changed=changed, diff=diff)
+
+
+if __name__ == "__main__":
+    _run_module()